@@ -0,0 +1,163 @@
+"""
+سجل الأنشطة
+Buffered activity (audit) log pipeline
+
+الوسيط يلتقط حدثاً لكل طلب API ويضعه في طابور داخل العملية دون أي رحلة
+إلى قاعدة البيانات، ثم يقوم BatchWriter بكتابة الأحداث دفعات عبر insert_many.
+"""
+
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from batch_writer import BatchWriter, OverflowPolicy
+
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = "activity_logs"
+
+# الإعدادات قابلة للتعديل عبر متغيرات البيئة
+STORAGE = os.environ.get('ACTIVITY_LOG_STORAGE', 'timeseries')  # timeseries | capped | ttl
+RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', '30'))
+CAPPED_SIZE_MB = int(os.environ.get('ACTIVITY_LOG_CAPPED_SIZE_MB', '512'))
+QUEUE_SIZE = int(os.environ.get('ACTIVITY_LOG_QUEUE_SIZE', '10000'))
+BATCH_SIZE = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', '500'))
+FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_LOG_FLUSH_INTERVAL', '1.0'))
+OVERFLOW_POLICY = os.environ.get('ACTIVITY_LOG_OVERFLOW_POLICY', OverflowPolicy.DROP_NEWEST.value)
+
+writer: Optional[BatchWriter] = None
+
+
+async def ensure_collection(db) -> None:
+    """إنشاء مجموعة السجل مع سياسة الاحتفاظ المناسبة"""
+    retention_seconds = RETENTION_DAYS * 24 * 60 * 60
+
+    if STORAGE == "capped":
+        try:
+            await db.create_collection(COLLECTION_NAME, capped=True, size=CAPPED_SIZE_MB * 1024 * 1024)
+        except CollectionInvalid:
+            pass
+        return
+
+    if STORAGE == "timeseries":
+        try:
+            await db.create_collection(
+                COLLECTION_NAME,
+                timeseries={"timeField": "created_at", "metaField": "resource_type", "granularity": "seconds"},
+                expireAfterSeconds=retention_seconds,
+            )
+            return
+        except CollectionInvalid:
+            return
+        except OperationFailure:
+            # خادم أقدم من MongoDB 5.0: مجموعة عادية مع فهرس TTL
+            logger.warning("المجموعات الزمنية غير مدعومة، سيتم استخدام فهرس TTL")
+
+    await db[COLLECTION_NAME].create_index("created_at", expireAfterSeconds=retention_seconds)
+
+
+async def start(db) -> None:
+    """تهيئة المجموعة وتشغيل كاتب الدفعات"""
+    global writer
+    await ensure_collection(db)
+    writer = BatchWriter(
+        db[COLLECTION_NAME],
+        max_queue_size=QUEUE_SIZE,
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+        overflow_policy=OverflowPolicy(OVERFLOW_POLICY),
+    )
+    writer.start()
+
+
+async def stop() -> None:
+    """تفريغ الأحداث المتبقية عند إيقاف الخادم"""
+    global writer
+    if writer is not None:
+        await writer.stop()
+        logger.info("سجل الأنشطة: كُتب %d حدث، أُسقط %d", writer.written, writer.dropped)
+        writer = None
+
+
+def _event(
+    action: str,
+    resource_type: str,
+    resource_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    details: Optional[dict] = None,
+    ip_address: Optional[str] = None,
+    user_agent: Optional[str] = None,
+) -> dict:
+    """بناء مستند بنفس حقول ActivityLog دون كلفة التحقق عبر Pydantic"""
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "action": action,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "details": details or {},
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def log_activity(action: str, resource_type: str, **fields) -> bool:
+    """تسجيل حدث من داخل الكود دون انتظار قاعدة البيانات"""
+    if writer is None:
+        return False
+    return writer.submit(_event(action, resource_type, **fields))
+
+
+class ActivityLogMiddleware:
+    """وسيط ASGI يسجل كل طلب تحت /api في سجل الأنشطة"""
+
+    def __init__(self, app, path_prefix: str = "/api"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        log_writer = writer
+        if scope["type"] != "http" or log_writer is None or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # /api/<resource_type>/<resource_id>/...
+            parts = scope["path"][len(self.path_prefix):].strip("/").split("/")
+            user_agent = None
+            for name, value in scope.get("headers", ()):
+                if name == b"user-agent":
+                    user_agent = value.decode("latin-1")
+                    break
+            client = scope.get("client")
+            await log_writer.put(_event(
+                action=scope["method"],
+                resource_type=parts[0] or "root",
+                resource_id=parts[1] if len(parts) > 1 else None,
+                user_id=scope.get("state", {}).get("user_id"),
+                details={
+                    "path": scope["path"],
+                    "status_code": status_code,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                },
+                ip_address=client[0] if client else None,
+                user_agent=user_agent,
+            ))
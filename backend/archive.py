@@ -0,0 +1,261 @@
+"""
+أرشفة الطلبات
+Time-partitioned order archive with hot/cold tiering
+
+الطلبات المنتهية (delivered, cancelled, refunded) الأقدم من مدة محددة تُنقل
+دفعات من مجموعة orders إلى مجموعات أرشيف شهرية orders_archive_YYYYMM، حتى
+تبقى المجموعة الساخنة وفهارسها صغيرة بما يكفي لتبقى في الذاكرة.
+
+مجموعة orders_archive_index تربط معرف الطلب بمجموعة الأرشيف، فيكفي
+استعلام نقطي واحد للعثور على طلب مؤرشف.
+
+أمثلة:
+    python archive.py --older-than-days 90
+    python archive.py --older-than-days 30 --max-batches 10
+"""
+
+import argparse
+import asyncio
+import heapq
+import logging
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pymongo import DeleteOne, ReplaceOne
+
+import order_codec
+from models import OrderStatus
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ORDER_ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ORDER_ARCHIVE_INTERVAL_HOURS', '0'))  # 0 = تعطيل الجدولة
+
+ARCHIVE_PREFIX = "orders_archive_"
+INDEX_COLLECTION = "orders_archive_index"
+TERMINAL_STATUSES = [OrderStatus.DELIVERED.value, OrderStatus.CANCELLED.value, OrderStatus.REFUNDED.value]
+
+_ARCHIVE_NAME = re.compile(rf"^{ARCHIVE_PREFIX}\d{{6}}$")
+
+
+def archive_name(created_at: datetime) -> str:
+    """اسم مجموعة الأرشيف لشهر الإنشاء"""
+    return f"{ARCHIVE_PREFIX}{created_at:%Y%m}"
+
+
+async def ensure_indexes(db) -> None:
+    """فهرس اختيار الطلبات المؤهلة للأرشفة وفهارس مجموعات الأرشيف الموجودة"""
+    await db.orders.create_index([("status", 1), ("created_at", 1)])
+    for name in await archive_collections(db):
+        await _ensure_archive_indexes(db[name])
+
+
+async def _ensure_archive_indexes(collection) -> None:
+    await collection.create_index("id", unique=True)
+    await collection.create_index([("user_id", 1), ("created_at", -1)])
+    # مسح iter_orders بالحالة والفترة مرتباً على created_at
+    await collection.create_index([("status", 1), ("created_at", 1)])
+
+
+async def _upsert_copies(collection, docs: List[Dict[str, Any]], key: str) -> None:
+    """نسخ يستبدل أي نسخة سابقة، فإعادة التشغيل بعد توقف جزئي تكتب آخر نسخة من الطلب"""
+    await collection.bulk_write(
+        [ReplaceOne({key: doc[key]}, doc, upsert=True) for doc in docs],
+        ordered=False,
+    )
+
+
+async def archive_batch(db, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """نقل دفعة واحدة من الطلبات المؤهلة؛ يعيد عدد الطلبات المنقولة"""
+    docs = await db.orders.find(
+        {"status": {"$in": TERMINAL_STATUSES}, "created_at": {"$lt": cutoff}}
+    ).sort("created_at", 1).limit(batch_size).to_list(batch_size)
+    if not docs:
+        return 0
+
+    by_month: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for doc in docs:
+        by_month[archive_name(doc["created_at"])].append(doc)
+
+    # 1) النسخ إلى الأرشيف والفهرس، 2) الحذف من المجموعة الساخنة
+    for name, month_docs in by_month.items():
+        await _ensure_archive_indexes(db[name])
+        await _upsert_copies(db[name], month_docs, "id")
+        await _upsert_copies(db[INDEX_COLLECTION], [{"_id": doc["id"], "c": name} for doc in month_docs], "_id")
+
+    # الحذف مشروط بعدم تغير الطلب منذ قراءته
+    result = await db.orders.bulk_write(
+        [DeleteOne({"_id": doc["_id"], "status": doc["status"], "updated_at": doc.get("updated_at")}) for doc in docs],
+        ordered=False,
+    )
+    if result.deleted_count < len(docs):
+        await _discard_stale_copies(db, docs)
+    return result.deleted_count
+
+
+async def _discard_stale_copies(db, docs: List[Dict[str, Any]]) -> None:
+    """حذف نسخ الأرشيف للطلبات التي تغيرت أثناء النقل وبقيت في المجموعة الساخنة"""
+    remaining = await db.orders.find(
+        {"_id": {"$in": [doc["_id"] for doc in docs]}}, {"_id": 1}
+    ).to_list(len(docs))
+    remaining_ids = {doc["_id"] for doc in remaining}
+    stale = [doc for doc in docs if doc["_id"] in remaining_ids]
+    by_month: Dict[str, List[Any]] = defaultdict(list)
+    for doc in stale:
+        by_month[archive_name(doc["created_at"])].append(doc["_id"])
+    for name, ids in by_month.items():
+        await db[name].delete_many({"_id": {"$in": ids}})
+    await db[INDEX_COLLECTION].delete_many({"_id": {"$in": [doc["id"] for doc in stale]}})
+
+
+async def archive_orders(
+    db,
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    max_batches: Optional[int] = None,
+) -> int:
+    """أرشفة كل الطلبات المؤهلة دفعات"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = await archive_batch(db, cutoff, batch_size)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+    logger.info("تمت أرشفة %d طلب في %d دفعة", total, batches)
+    return total
+
+
+# =====================================================
+# READ PATH - القراءة من الأرشيف
+# =====================================================
+
+async def find_archived_order(db, order_id: str, projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """البحث عن طلب مؤرشف عبر فهرس الأرشيف"""
+    location = await db[INDEX_COLLECTION].find_one({"_id": order_codec.match_id(order_id)})
+    if not location:
+        return None
+    return await db[location["c"]].find_one({"id": order_codec.match_id(order_id)}, projection)
+
+
+async def locate_archived_orders(db, order_ids: List[str]) -> Dict[str, str]:
+    """مجموعة الأرشيف لكل طلب مؤرشف من القائمة"""
+    return {
+        order_codec.decode_uuid(location["_id"]): location["c"]
+        async for location in db[INDEX_COLLECTION].find({"_id": order_codec.match_ids(order_ids)})
+    }
+
+
+async def archive_collections(db, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+    """مجموعات الأرشيف التي تغطي الفترة المطلوبة مرتبة زمنياً"""
+    names = sorted(name for name in await db.list_collection_names() if _ARCHIVE_NAME.match(name))
+    if start is not None:
+        names = [name for name in names if name >= archive_name(start)]
+    if end is not None:
+        names = [name for name in names if name <= archive_name(end)]
+    return names
+
+
+async def _iter_archived(db, query: Dict[str, Any], start: Optional[datetime], end: Optional[datetime],
+                         batch_size: int, projection: Optional[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """الطلبات المؤرشفة مرتبة؛ المجموعات الشهرية لا تتداخل فيكفي المرور عليها بالترتيب"""
+    for name in await archive_collections(db, start, end):
+        async for doc in db[name].find(query, projection).sort("created_at", 1).batch_size(batch_size):
+            yield doc
+
+
+async def _merge_by_created_at(*streams: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """دمج تدفقات مرتبة على created_at في تدفق واحد مرتب"""
+    heap = []
+    for index, stream in enumerate(streams):
+        async for doc in stream:
+            heap.append((doc["created_at"], index, doc))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, index, doc = heap[0]
+        yield doc
+        async for following in streams[index]:
+            heapq.heapreplace(heap, (following["created_at"], index, following))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+async def iter_orders(db, query: Dict[str, Any], start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      batch_size: int = 1000, projection: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """كل الطلبات المطابقة من الأرشيف والمجموعة الساخنة مدمجة بترتيب created_at
+
+    الطلبات المكتملة لا تُؤرشف فقد تكون في المجموعة الساخنة طلبات أقدم من طلبات مؤرشفة.
+    """
+    if projection is not None and any(projection.values()):
+        projection = {**projection, "created_at": 1}
+    archived = _iter_archived(db, query, start, end, batch_size, projection)
+    hot = db.orders.find(query, projection).sort("created_at", 1).batch_size(batch_size)
+    try:
+        async for doc in _merge_by_created_at(archived, hot.__aiter__()):
+            yield doc
+    finally:
+        await archived.aclose()
+
+
+# =====================================================
+# SCHEDULER - الجدولة
+# =====================================================
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run_periodically(db) -> None:
+    while True:
+        try:
+            await archive_orders(db)
+        except Exception:
+            logger.exception("فشلت أرشفة الطلبات")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+async def start(db) -> None:
+    """تشغيل الأرشفة الدورية إذا ضُبط ORDER_ARCHIVE_INTERVAL_HOURS"""
+    global _task
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        _task = asyncio.create_task(_run_periodically(db))
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+async def main(args) -> None:
+    import database
+
+    db = database.connect()
+    try:
+        await ensure_indexes(db)
+        moved = await archive_orders(db, args.older_than_days, args.batch_size, args.max_batches)
+        print(f"📦 تمت أرشفة {moved} طلب")
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="أرشفة الطلبات المنتهية إلى مجموعات شهرية")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=None)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,151 @@
+"""
+المصادقة وكلمات المرور
+Password hashing and stateless JWT authentication
+
+تجزئة كلمات المرور عملية مكلفة للمعالج، لذلك تعمل في مجمع خيوط مخصص ومحدود
+حتى لا توقف حلقة الأحداث ولا تستهلك مجمع الخيوط الافتراضي الذي تستخدمه
+بقية الطلبات أثناء موجات تسجيل الدخول.
+"""
+
+import asyncio
+import logging
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+import jwt
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+logger = logging.getLogger(__name__)
+
+# إعدادات التجزئة: المخطط الأول يُستخدم للتجزئات الجديدة، والبقية للتحقق فقط
+PASSWORD_HASH_SCHEMES = os.environ.get('PASSWORD_HASH_SCHEMES', 'pbkdf2_sha256').split(',')
+PASSWORD_HASH_ROUNDS = os.environ.get('PASSWORD_HASH_ROUNDS')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+JWT_EXPIRE_MINUTES = int(os.environ.get('JWT_EXPIRE_MINUTES', '60'))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_bearer = HTTPBearer(auto_error=False)
+
+
+@lru_cache(maxsize=1)
+def _crypt_context() -> "CryptContext":
+    # passlib يُستورد عند أول استخدام لا عند بدء العامل
+    from passlib.context import CryptContext
+
+    settings = {}
+    if PASSWORD_HASH_ROUNDS:
+        settings[f"{PASSWORD_HASH_SCHEMES[0]}__rounds"] = int(PASSWORD_HASH_ROUNDS)
+    return CryptContext(schemes=PASSWORD_HASH_SCHEMES, deprecated="auto", **settings)
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    """تجزئة وهمية لمساواة زمن الاستجابة عند عدم وجود البريد"""
+    return _crypt_context().hash(secrets.token_urlsafe(16))
+
+
+@lru_cache(maxsize=1)
+def _signing_key() -> str:
+    key = os.environ.get('JWT_SECRET')
+    if not key:
+        # مفتاح مؤقت لكل عملية؛ يجب ضبط JWT_SECRET عند تشغيل أكثر من عامل
+        logger.warning("JWT_SECRET غير مضبوط، سيتم استخدام مفتاح مؤقت")
+        key = secrets.token_urlsafe(32)
+    return key
+
+
+def warm_up() -> None:
+    """تهيئة سياق التجزئة ومفتاح التوقيع قبل أول طلب"""
+    _crypt_context()
+    _signing_key()
+
+
+async def hash_password(password: str) -> str:
+    """تجزئة كلمة المرور خارج حلقة الأحداث"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, _crypt_context().hash, password)
+
+
+async def verify_password(password: str, password_hash: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """التحقق من كلمة المرور؛ يعيد تجزئة جديدة إذا تغيرت إعدادات التجزئة"""
+    loop = asyncio.get_running_loop()
+    if not password_hash:
+        await loop.run_in_executor(_hash_executor, _crypt_context().verify, password, _dummy_hash())
+        return False, None
+    return await loop.run_in_executor(
+        _hash_executor, _crypt_context().verify_and_update, password, password_hash
+    )
+
+
+def create_access_token(user_id: str, role: str) -> str:
+    """إصدار رمز JWT موقّع"""
+    now = datetime.utcnow()
+    payload = {
+        "sub": user_id,
+        "role": role,
+        "iat": now,
+        "exp": now + timedelta(minutes=JWT_EXPIRE_MINUTES),
+    }
+    return jwt.encode(payload, _signing_key(), algorithm=JWT_ALGORITHM)
+
+
+def decode_access_token(token: str) -> Dict[str, Any]:
+    """التحقق من الرمز دون الرجوع إلى قاعدة البيانات"""
+    try:
+        return jwt.decode(token, _signing_key(), algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="انتهت صلاحية رمز الدخول")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="رمز الدخول غير صالح")
+
+
+async def get_token_payload(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+) -> Dict[str, Any]:
+    """اعتمادية FastAPI: تستخرج بيانات الرمز وتسجل المستخدم في حالة الطلب"""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="مطلوب تسجيل الدخول")
+    payload = decode_access_token(credentials.credentials)
+    request.state.user_id = payload["sub"]
+    return payload
+
+
+async def get_current_user_id(payload: Dict[str, Any] = Depends(get_token_payload)) -> str:
+    """معرف المستخدم الحالي"""
+    return payload["sub"]
+
+
+async def get_stream_user_id(
+    request: Request,
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+) -> str:
+    """معرف المستخدم لاتصالات البث؛ EventSource لا يرسل ترويسات فيُقبل الرمز في token"""
+    if credentials is not None:
+        token = credentials.credentials
+    if not token:
+        raise HTTPException(status_code=401, detail="مطلوب تسجيل الدخول")
+    payload = decode_access_token(token)
+    request.state.user_id = payload["sub"]
+    return payload["sub"]
+
+
+def require_roles(*roles: str):
+    """اعتمادية تسمح فقط للأدوار المحددة"""
+    async def dependency(payload: Dict[str, Any] = Depends(get_token_payload)) -> Dict[str, Any]:
+        if payload.get("role") not in roles:
+            raise HTTPException(status_code=403, detail="غير مصرح")
+        return payload
+    return dependency
@@ -0,0 +1,167 @@
+"""
+كاتب دفعات غير متزامن
+Buffered, batched MongoDB writer
+
+يستقبل المستندات في طابور محدود داخل العملية ويكتبها دفعة واحدة عبر
+insert_many عند امتلاء الدفعة أو انقضاء مهلة التفريغ، بدلاً من رحلة
+ذهاب وعودة لكل مستند.
+"""
+
+import asyncio
+import logging
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(str, Enum):
+    """سياسة التعامل مع امتلاء الطابور"""
+    DROP_NEWEST = "drop_newest"   # تجاهل المستند الجديد
+    DROP_OLDEST = "drop_oldest"   # إسقاط أقدم مستند لإفساح المجال
+    BLOCK = "block"               # انتظار توفر مساحة (ضغط عكسي)
+
+
+class BatchWriter:
+    """كاتب دفعات بطابور محدود ومهمة تفريغ في الخلفية"""
+
+    def __init__(
+        self,
+        collection,
+        *,
+        max_queue_size: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_NEWEST,
+        on_flush: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.on_flush = on_flush
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._batch: List[Dict[str, Any]] = []
+        self._inflight: Optional[asyncio.Future] = None
+        self.dropped = 0
+        self.written = 0
+
+    @property
+    def pending(self) -> int:
+        """عدد المستندات المنتظرة في الطابور"""
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """تشغيل مهمة التفريغ في الخلفية"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, document: Dict[str, Any]) -> bool:
+        """إضافة مستند دون انتظار؛ يعيد False إذا أُسقط مستند بسبب الامتلاء"""
+        try:
+            self._queue.put_nowait(document)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            self._queue.put_nowait(document)
+        self.dropped += 1
+        return False
+
+    async def put(self, document: Dict[str, Any]) -> bool:
+        """إضافة مستند مع احترام سياسة الامتلاء (BLOCK ينتظر توفر مساحة)"""
+        if self.overflow_policy == OverflowPolicy.BLOCK:
+            await self._queue.put(document)
+            return True
+        return self.submit(document)
+
+    async def stop(self) -> None:
+        """إيقاف مهمة الخلفية وتفريغ كل ما تبقى في الطابور"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # إكمال الكتابة الجارية ثم الدفعة التي كانت قيد التجميع
+        if self._inflight is not None:
+            await self._inflight
+            self._inflight = None
+        batch, self._batch = self._batch, []
+        await self._write(batch)
+
+        while not self._queue.empty():
+            await self._write(self._drain())
+
+    def _drain(self, first: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            deadline = loop.time() + self.flush_interval
+            self._batch = self._drain(first)
+
+            # انتظار اكتمال الدفعة حتى انقضاء المهلة
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._batch.extend(self._drain(item))
+
+            # الكتابة محمية من الإلغاء حتى لا تضيع دفعة أثناء الإيقاف
+            batch, self._batch = self._batch, []
+            self._inflight = asyncio.ensure_future(self._write(batch))
+            try:
+                await asyncio.shield(self._inflight)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("فشلت دفعة في %s", self.collection.name)
+            self._inflight = None
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            self.dropped += len(failed)
+            logger.warning("فشل إدخال %d مستند في %s", len(failed), self.collection.name)
+            batch = [doc for i, doc in enumerate(batch) if i not in failed]
+            self.written += len(batch)
+        except Exception:
+            # أي خطأ (مثل InvalidDocument لمستند لا يمكن ترميزه) يُسقط الدفعة فقط ولا يوقف الكاتب
+            self.dropped += len(batch)
+            logger.exception("تعذر كتابة دفعة من %d مستند في %s", len(batch), self.collection.name)
+            return
+
+        if self.on_flush is not None:
+            try:
+                await self.on_flush(batch)
+            except Exception:
+                logger.exception("فشل معالج ما بعد التفريغ لـ %s", self.collection.name)
@@ -0,0 +1,399 @@
+"""
+قياس أداء الواجهة البرمجية
+Reproducible load-test / benchmark harness for the API
+
+يشغّل server.app داخل العملية مقابل خادم mongod مؤقت (أو mongomock-motor
+لقياسات المعالج فقط)، ويملأ قاعدة البيانات بحجم قابل للضبط، ثم يرسل طلبات
+حقيقية بتزامن ثابت ويسجل الإنتاجية وp50/p95/p99 في ملف JSON لكل commit.
+
+أمثلة:
+    python benchmark.py --backend mongomock --orders 5000
+    python benchmark.py --backend mongod --orders 200000 --concurrency 64
+    python benchmark.py --compare benchmark_results/<old-commit>.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+
+ROOT_DIR = Path(__file__).parent
+RESULTS_DIR = ROOT_DIR / "benchmark_results"
+SEED = 20241206
+
+
+# =====================================================
+# DATABASE - قاعدة البيانات المؤقتة
+# =====================================================
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalMongod:
+    """خادم mongod مؤقت بمجلد بيانات يُحذف عند الإيقاف"""
+
+    def __init__(self, binary: str = "mongod"):
+        self.binary = shutil.which(binary) or binary
+        self.port = _free_port()
+        self.dbpath = tempfile.mkdtemp(prefix="bench-mongod-")
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"mongodb://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 30.0) -> None:
+        from pymongo import MongoClient
+        from pymongo.errors import PyMongoError
+
+        self.process = subprocess.Popen(
+            [self.binary, "--dbpath", self.dbpath, "--port", str(self.port),
+             "--bind_ip", "127.0.0.1", "--quiet", "--nounixsocket"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"توقف mongod برمز {self.process.returncode}")
+            try:
+                MongoClient(self.url, serverSelectionTimeoutMS=500).admin.command("ping")
+                return
+            except PyMongoError:
+                time.sleep(0.2)
+        raise RuntimeError("انتهت مهلة انتظار mongod")
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+def load_app(backend: str, mongo_url: Optional[str], db_name: str):
+    """استيراد server.app بعد توجيه اتصال قاعدة البيانات"""
+    sys.path.insert(0, str(ROOT_DIR))
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if backend == "mongomock":
+        # mongomock لا يدعم المجموعات الزمنية ولا change streams
+        os.environ["ACTIVITY_LOG_STORAGE"] = "ttl"
+        os.environ["ORDER_EVENTS_MODE"] = "polling"
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        from mongomock_motor import AsyncMongoMockClient
+        import database
+        database.client = AsyncMongoMockClient()
+        database.db = database.client[db_name]
+    else:
+        os.environ["MONGO_URL"] = mongo_url
+
+    import database
+    import server
+    # server يضبط مستوى السجل INFO، فيسجل httpx كل طلب داخل حلقة القياس
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return server.app, database.connect()
+
+
+# =====================================================
+# SEEDING - تعبئة البيانات
+# =====================================================
+
+async def seed(db, services: int, cards: int, users: int, orders: int, batch_size: int = 5000) -> Dict[str, List[Any]]:
+    """تعبئة قاعدة البيانات ببيانات عشوائية قابلة للتكرار"""
+    from models import CardProduct, CardProvider, Order, OrderStatus, Service, ServiceType, User
+
+    rng = random.Random(SEED)
+    now = datetime.utcnow()
+
+    service_docs = [
+        Service(
+            name=f"Service {i}", name_ar=f"خدمة {i}",
+            description="Benchmark service", description_ar="خدمة للقياس",
+            service_type=list(ServiceType)[i % len(ServiceType)], display_order=i,
+        ).model_dump()
+        for i in range(services)
+    ]
+    await db.services.insert_many(service_docs)
+
+    card_docs = []
+    for i in range(cards):
+        price = rng.choice([5, 10, 25, 50, 100, 200])
+        card_docs.append(CardProduct(
+            name=f"Card {i}", name_ar=f"بطاقة {i}",
+            provider=rng.choice(list(CardProvider)),
+            service_id=rng.choice(service_docs)["id"],
+            denomination=float(price), price=price * 1.05,
+            discount_percentage=rng.choice([0.0, 0.0, 5.0, 10.0]),
+            total_sold=rng.randint(0, 10000),
+        ).model_dump())
+    await db.card_products.insert_many(card_docs)
+
+    user_docs = [
+        User(email=f"user{i}@bench.example.com", full_name=f"User {i}").model_dump()
+        for i in range(users)
+    ]
+    for start in range(0, len(user_docs), batch_size):
+        await db.users.insert_many(user_docs[start:start + batch_size])
+
+    statuses = list(OrderStatus)
+    batch = []
+    for i in range(orders):
+        user = rng.choice(user_docs)
+        items = []
+        for _ in range(rng.randint(1, 3)):
+            card = rng.choice(card_docs)
+            items.append({"card_product_id": card["id"], "quantity": rng.randint(1, 3), "unit_price": card["price"]})
+        subtotal = sum(item["unit_price"] * item["quantity"] for item in items)
+        batch.append(Order(
+            order_number=f"BENCH-{i:010d}",
+            user_id=user["id"], customer_email=user["email"], customer_name=user["full_name"],
+            items=items, status=rng.choice(statuses), subtotal=subtotal, total_amount=subtotal,
+            created_at=now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600)),
+        ).to_storage())
+        if len(batch) >= batch_size:
+            await db.orders.insert_many(batch)
+            batch = []
+    if batch:
+        await db.orders.insert_many(batch)
+
+    return {"services": service_docs, "cards": card_docs, "users": user_docs}
+
+
+# =====================================================
+# SCENARIOS - سيناريوهات الحمل
+# =====================================================
+
+def build_scenarios(data: Dict[str, List[Any]]) -> Dict[str, Callable[[random.Random], Dict[str, Any]]]:
+    """كل سيناريو يولّد طلباً عشوائياً (الطريقة، المسار، المعاملات، الجسم)"""
+    from models import CardProvider, OrderStatus
+
+    services, cards, users = data["services"], data["cards"], data["users"]
+
+    def cards_filter(rng):
+        params: Dict[str, Any] = {}
+        choice = rng.random()
+        if choice < 0.3:
+            params["provider"] = rng.choice(list(CardProvider)).value
+        elif choice < 0.6:
+            params["service_id"] = rng.choice(services)["id"]
+        if rng.random() < 0.5:
+            params["min_price"] = rng.choice([0, 10, 50])
+            params["max_price"] = params["min_price"] + rng.choice([20, 100, 500])
+        return {"method": "GET", "url": "/api/cards", "params": params}
+
+    def orders_create(rng):
+        user = rng.choice(users)
+        items = [
+            {"card_product_id": card["id"], "quantity": rng.randint(1, 3), "unit_price": card["price"]}
+            for card in rng.sample(cards, rng.randint(1, 3))
+        ]
+        return {"method": "POST", "url": "/api/orders", "json": {
+            "user_id": user["id"], "customer_email": user["email"],
+            "customer_name": user["full_name"], "items": items,
+        }}
+
+    def orders_list(rng):
+        params: Dict[str, Any] = {"user_id": rng.choice(users)["id"], "limit": 50}
+        if rng.random() < 0.3:
+            params["status"] = rng.choice(list(OrderStatus)).value
+        return {"method": "GET", "url": "/api/orders", "params": params}
+
+    def analytics_dashboard(rng):
+        return {"method": "GET", "url": "/api/analytics/dashboard"}
+
+    return {
+        "cards_filter": cards_filter,
+        "orders_create": orders_create,
+        "orders_list": orders_list,
+        "analytics_dashboard": analytics_dashboard,
+    }
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """النسبة المئوية بطريقة أقرب رتبة"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct * len(sorted_values) / 100) - 1))
+    return sorted_values[rank]
+
+
+async def run_scenario(client, make_request, requests: int, concurrency: int, warmup: int, seed: int) -> Dict[str, Any]:
+    """تشغيل سيناريو بعدد ثابت من العمال المتزامنين"""
+    rng = random.Random(seed)
+    planned = [make_request(rng) for _ in range(warmup + requests)]
+
+    for request in planned[:warmup]:
+        await client.request(**request)
+
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(planned[warmup:])
+
+    async def worker():
+        nonlocal errors
+        for request in pending:
+            started = time.perf_counter()
+            response = await client.request(**request)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "duration_s": round(elapsed, 4),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+    }
+
+
+# =====================================================
+# RESULTS - النتائج والمقارنة
+# =====================================================
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> bool:
+    """طباعة الفروق مقارنة بنتيجة سابقة؛ يعيد False عند تراجع يتجاوز الحد"""
+    ok = True
+    print(f"\nمقارنة {current['commit']} مع {baseline['commit']}:")
+    print(f"{'scenario':<22}{'rps':>12}{'Δ%':>9}{'p95 ms':>12}{'Δ%':>9}")
+    for name, result in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if not base:
+            continue
+        rps_delta = (result["throughput_rps"] / base["throughput_rps"] - 1) * 100 if base["throughput_rps"] else 0.0
+        p95, base_p95 = result["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        p95_delta = (p95 / base_p95 - 1) * 100 if base_p95 else 0.0
+        flag = ""
+        if rps_delta < -max_regression or p95_delta > max_regression:
+            ok = False
+            flag = "  ⚠️"
+        print(f"{name:<22}{result['throughput_rps']:>12.1f}{rps_delta:>+9.1f}{p95:>12.2f}{p95_delta:>+9.1f}{flag}")
+    return ok
+
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+
+    mongod = None
+    if args.backend == "mongod":
+        mongod = LocalMongod(args.mongod_bin)
+        mongod.start()
+    try:
+        app, db = load_app(args.backend, mongod.url if mongod else None, args.db_name)
+
+        print(f"🌱 تعبئة البيانات: {args.orders} طلب، {args.users} مستخدم، {args.cards} بطاقة")
+        data = await seed(db, args.services, args.cards, args.users, args.orders)
+
+        scenarios = build_scenarios(data)
+        selected = args.scenarios or list(scenarios)
+        results = {}
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                for index, name in enumerate(selected):
+                    print(f"🚀 {name}: {args.requests} طلب بتزامن {args.concurrency}")
+                    results[name] = await run_scenario(
+                        client, scenarios[name], args.requests, args.concurrency, args.warmup, SEED + index
+                    )
+                    latency = results[name]["latency_ms"]
+                    print(f"   {results[name]['throughput_rps']} req/s  p50={latency['p50']}ms "
+                          f"p95={latency['p95']}ms p99={latency['p99']}ms  errors={results[name]['errors']}")
+    finally:
+        if mongod is not None:
+            mongod.stop()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "backend": args.backend,
+            "services": args.services,
+            "cards": args.cards,
+            "users": args.users,
+            "orders": args.orders,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scenarios": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="قياس أداء واجهة منصة البطاقات الرقمية")
+    parser.add_argument("--backend", choices=["mongod", "mongomock"], default="mongod")
+    parser.add_argument("--mongod-bin", default="mongod")
+    parser.add_argument("--db-name", default="benchmark")
+    parser.add_argument("--services", type=int, default=5)
+    parser.add_argument("--cards", type=int, default=100)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000, help="عدد الطلبات لكل سيناريو")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--scenarios", nargs="*", choices=["cards_filter", "orders_create", "orders_list", "analytics_dashboard"])
+    parser.add_argument("--output", type=Path, help="ملف النتائج (افتراضي: benchmark_results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="ملف نتائج سابق للمقارنة")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="نسبة التراجع المسموحة %%")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+
+    output = args.output or RESULTS_DIR / f"{result['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"\n💾 النتائج: {output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if not compare(result, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+اتصال قاعدة البيانات
+MongoDB connection shared by the API modules
+
+الاتصال لا يُنشأ عند الاستيراد بل عبر connect() في دورة حياة التطبيق؛ لذلك
+تصل الوحدات إلى database.db وقت التنفيذ لا عبر from database import db.
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+from pymongo import monitoring
+
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """مراقبة مجمع الاتصالات: عدد الطلبات المنتظرة لاتصال وعدد الاتصالات المستخدمة"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.checked_out = 0
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+pool_monitor = PoolMonitor()
+
+# حجم مجمع الاتصالات لكل عملية؛ launcher.py يقسم MONGO_MAX_CONNECTIONS على العمال
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+
+# MongoDB connection (يُنشأ عند connect)
+client: Optional["AsyncIOMotorClient"] = None
+db: Optional["AsyncIOMotorDatabase"] = None
+
+
+def connect():
+    """إنشاء العميل عند أول استدعاء وإعادة قاعدة البيانات"""
+    global client, db
+    if client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(
+            os.environ['MONGO_URL'], maxPoolSize=MONGO_MAX_POOL_SIZE, event_listeners=[pool_monitor]
+        )
+        db = client[os.environ['DB_NAME']]
+    return db
+
+
+def close() -> None:
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
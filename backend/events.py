@@ -0,0 +1,81 @@
+"""
+بث الأحداث داخل العملية
+In-process pub/sub hub and Server-Sent Events helpers
+
+كل اتصال SSE مشترك يملك طابوراً صغيراً فقط، لذلك تبقى كلفة الاتصالات
+الخاملة منخفضة: لا مهام خلفية ولا استعلامات لكل اتصال.
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Hashable, Optional, Set
+
+
+HEARTBEAT_SECONDS = 15.0
+
+
+class EventHub:
+    """توزيع الأحداث على المشتركين حسب المفتاح"""
+
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self._subscribers: Dict[Hashable, Set[asyncio.Queue]] = {}
+
+    def subscribe(self, key: Hashable) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(key, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, key: Hashable, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(key)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[key]
+
+    def publish(self, key: Hashable, event: Any) -> int:
+        """نشر حدث دون انتظار؛ المشترك البطيء يفقد أقدم أحداثه"""
+        queues = self._subscribers.get(key)
+        if not queues:
+            return 0
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+        return len(queues)
+
+    def keys(self):
+        return self._subscribers.keys()
+
+    def has_subscribers(self, key: Hashable) -> bool:
+        return key in self._subscribers
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+
+def sse_message(data: Any, event: Optional[str] = None, event_id: Optional[str] = None) -> bytes:
+    """تنسيق رسالة SSE"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, default=str))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+async def queue_events(queue: asyncio.Queue, heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[Optional[Any]]:
+    """قراءة أحداث الطابور؛ يعيد None عند انقضاء مهلة النبض"""
+    while True:
+        try:
+            yield await asyncio.wait_for(queue.get(), heartbeat)
+        except asyncio.TimeoutError:
+            yield None
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
@@ -0,0 +1,232 @@
+"""
+تشغيل الخادم بعدة عمليات
+Multi-worker production launcher
+
+يشغل عدداً من عمليات uvicorn بحسب الأنوية المتاحة للعملية (أو WEB_CONCURRENCY).
+كل عامل يربط مقبسه الخاص مع SO_REUSEPORT فتوزع النواة الاتصالات بين العمال دون
+عملية وسيطة، ويبدأ الاستماع فقط بعد اكتمال دورة حياة التطبيق.
+
+- SIGHUP: إعادة تشغيل متدرجة؛ عامل جديد يجهز قبل إيقاف كل عامل قديم بلطف
+- SIGINT/SIGTERM: إيقاف جميع العمال بلطف
+- العامل الذي يتوقف بشكل غير متوقع يُعاد تشغيله
+
+حجم مجمع اتصالات MongoDB لكل عامل = MONGO_MAX_CONNECTIONS ÷ (العمال + 1)،
+والعامل الإضافي هو العامل الجديد أثناء إعادة التشغيل المتدرجة.
+
+أمثلة:
+    python launcher.py --host 0.0.0.0 --port 8001
+    WEB_CONCURRENCY=8 MONGO_MAX_CONNECTIONS=800 python launcher.py
+    kill -HUP <pid>    # إعادة تشغيل متدرجة بعد النشر
+"""
+
+import argparse
+import importlib.util
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Dict, List, Optional
+
+
+logger = logging.getLogger("launcher")
+
+MONGO_MAX_CONNECTIONS = int(os.environ.get('MONGO_MAX_CONNECTIONS', '500'))
+GRACEFUL_TIMEOUT = int(os.environ.get('WORKER_GRACEFUL_TIMEOUT', '30'))
+READY_TIMEOUT = float(os.environ.get('WORKER_READY_TIMEOUT', '60'))
+# أقل مدة لتشغيل العامل قبل اعتبار توقفه تعطلاً متكرراً يستدعي التأخير
+MIN_WORKER_UPTIME = 5.0
+
+_spawn = multiprocessing.get_context("spawn")
+
+
+def available_cpus() -> int:
+    """الأنوية المسموحة لهذه العملية (تحترم taskset وحدود الحاوية في affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def worker_count() -> int:
+    workers = os.environ.get('WEB_CONCURRENCY')
+    return max(1, int(workers)) if workers else available_cpus()
+
+
+def pool_size_per_worker(workers: int, max_connections: int = MONGO_MAX_CONNECTIONS) -> int:
+    return max(1, max_connections // (workers + 1))
+
+
+def event_loop_impl() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_impl() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """مقبس مربوط مع SO_REUSEPORT دون listen؛ يبدأ uvicorn الاستماع بعد دورة الحياة"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(options: Dict, pool_size: int, ready) -> None:
+    """نقطة دخول عملية العامل"""
+    os.environ["MONGO_MAX_POOL_SIZE"] = str(pool_size)
+
+    import uvicorn
+
+    class Server(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets=sockets)
+            if not self.should_exit:
+                ready.set()
+
+    config = uvicorn.Config(
+        options["app"],
+        loop=options["loop"],
+        http=options["http"],
+        log_level=options["log_level"],
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+    )
+    Server(config).run(sockets=[bind_socket(options["host"], options["port"])])
+
+
+class Worker:
+    def __init__(self, process, ready):
+        self.process = process
+        self.ready = ready
+        self.started_at = time.monotonic()
+
+
+class Supervisor:
+    """تشغيل العمال ومراقبتهم"""
+
+    def __init__(self, options: Dict, workers: int):
+        self.options = options
+        self.workers_count = workers
+        self.pool_size = pool_size_per_worker(workers)
+        self.workers: List[Worker] = []
+        self._stopping = False
+        self._reload = False
+
+    def spawn(self) -> Worker:
+        ready = _spawn.Event()
+        process = _spawn.Process(
+            target=_run_worker, args=(self.options, self.pool_size, ready), name="uvicorn-worker"
+        )
+        process.start()
+        worker = Worker(process, ready)
+        self.workers.append(worker)
+        return worker
+
+    def stop_worker(self, worker: Worker) -> None:
+        """إيقاف لطيف: uvicorn يتوقف عن قبول الاتصالات ويكمل الطلبات الجارية"""
+        if worker.process.is_alive():
+            os.kill(worker.process.pid, signal.SIGTERM)
+        worker.process.join(GRACEFUL_TIMEOUT + 5)
+        if worker.process.is_alive():
+            logger.warning("العامل %d لم يتوقف في المهلة، سيتم إنهاؤه", worker.process.pid)
+            worker.process.kill()
+            worker.process.join()
+        if worker in self.workers:
+            self.workers.remove(worker)
+
+    def rolling_restart(self) -> None:
+        logger.info("إعادة تشغيل متدرجة لـ %d عامل", len(self.workers))
+        for old in list(self.workers):
+            if self._stopping:
+                return
+            new = self.spawn()
+            if not new.ready.wait(READY_TIMEOUT):
+                # العامل الجديد لم يجهز: إيقاف إعادة التشغيل والإبقاء على القدامى
+                logger.error("العامل الجديد %d لم يجهز خلال %.0f ثانية، أُلغيت إعادة التشغيل", new.process.pid, READY_TIMEOUT)
+                self.stop_worker(new)
+                return
+            self.stop_worker(old)
+        logger.info("اكتملت إعادة التشغيل المتدرجة")
+
+    def reap(self) -> None:
+        """إعادة تشغيل العمال المتوقفين بشكل غير متوقع"""
+        for worker in list(self.workers):
+            if worker.process.is_alive():
+                continue
+            self.workers.remove(worker)
+            logger.warning("توقف العامل %d (رمز الخروج %s)، سيتم إعادة تشغيله", worker.process.pid, worker.process.exitcode)
+            if time.monotonic() - worker.started_at < MIN_WORKER_UPTIME:
+                time.sleep(1)
+            self.spawn()
+
+    def _on_stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _on_reload(self, signum, frame) -> None:
+        self._reload = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        logger.info(
+            "تشغيل %d عامل على %s:%d (loop=%s, http=%s, maxPoolSize=%d لكل عامل)",
+            self.workers_count, self.options["host"], self.options["port"],
+            self.options["loop"], self.options["http"], self.pool_size,
+        )
+        for _ in range(self.workers_count):
+            self.spawn()
+
+        while not self._stopping:
+            time.sleep(0.5)
+            if self._reload:
+                self._reload = False
+                self.rolling_restart()
+            if not self._stopping:
+                self.reap()
+
+        logger.info("إيقاف %d عامل", len(self.workers))
+        for worker in self.workers:
+            if worker.process.is_alive():
+                os.kill(worker.process.pid, signal.SIGTERM)
+        for worker in list(self.workers):
+            self.stop_worker(worker)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="تشغيل الخادم بعدة عمليات uvicorn")
+    parser.add_argument("--app", default="server:app")
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument("--workers", type=int, default=None, help="افتراضي: WEB_CONCURRENCY أو عدد الأنوية المتاحة")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("SO_REUSEPORT غير مدعوم على هذا النظام؛ استخدم uvicorn --workers")
+
+    workers = args.workers or worker_count()
+    if workers > 1 and not os.environ.get('JWT_SECRET'):
+        parser.error("JWT_SECRET مطلوب مع أكثر من عامل: كل عامل سيولد مفتاحاً مختلفاً وتُرفض الرموز بين العمال")
+
+    options = {
+        "app": args.app,
+        "host": args.host,
+        "port": args.port,
+        "loop": event_loop_impl(),
+        "http": http_impl(),
+        "log_level": args.log_level,
+    }
+    Supervisor(options, workers).run()
+
+
+if __name__ == "__main__":
+    main()
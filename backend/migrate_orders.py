@@ -0,0 +1,105 @@
+"""
+ترحيل الطلبات إلى الصيغة المضغوطة
+Migrate stored orders to (or from) the compact storage format
+
+أمثلة:
+    python migrate_orders.py --report            # تقدير الحجم دون تعديل
+    python migrate_orders.py                     # ترحيل كل الطلبات
+    python migrate_orders.py --reverse           # العودة إلى الصيغة الكاملة
+"""
+
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+import bson
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
+
+import order_codec
+
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+class SizeReport:
+    """إحصاء حجم المستندات قبل الترحيل وبعده"""
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def add(self, before: dict, after: dict) -> None:
+        self.count += 1
+        self.bytes_before += len(bson.encode(before))
+        self.bytes_after += len(bson.encode(after))
+
+    def print(self, title: str) -> None:
+        if not self.count:
+            print(f"{title}: لا توجد طلبات")
+            return
+        before = self.bytes_before / self.count
+        after = self.bytes_after / self.count
+        print(f"{title}: {self.count} طلب")
+        print(f"   • قبل: {before:.1f} بايت/طلب ({self.bytes_before / 1024 / 1024:.2f} MB)")
+        print(f"   • بعد: {after:.1f} بايت/طلب ({self.bytes_after / 1024 / 1024:.2f} MB)")
+        print(f"   • التوفير: {(1 - after / before) * 100:.1f}%")
+
+
+async def migrate(collection, batch_size: int, reverse: bool, report_only: bool, limit: int) -> SizeReport:
+    """تحويل الطلبات دفعات عبر bulk_write"""
+    report = SizeReport()
+    convert = order_codec.decode_order if reverse else order_codec.encode_order
+    query = {order_codec.FORMAT_FIELD: {"$exists": reverse}}
+
+    cursor = collection.find(query).sort("_id", 1).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    operations = []
+    skipped = 0
+    async for doc in cursor:
+        converted = convert(doc)
+        report.add(doc, converted)
+        if report_only:
+            continue
+        # المطابقة على الحالة ووقت التحديث حتى لا يُستبدل تحديث متزامن
+        operations.append(ReplaceOne(
+            {"_id": doc["_id"], "status": doc.get("status"), "updated_at": doc.get("updated_at")},
+            converted,
+        ))
+        if len(operations) >= batch_size:
+            result = await collection.bulk_write(operations, ordered=False)
+            skipped += len(operations) - result.matched_count
+            operations = []
+    if operations:
+        result = await collection.bulk_write(operations, ordered=False)
+        skipped += len(operations) - result.matched_count
+
+    if skipped:
+        print(f"⚠️ تم تخطي {skipped} طلب تغير أثناء الترحيل؛ أعد التشغيل لترحيلها")
+    return report
+
+
+async def main(args) -> None:
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        report = await migrate(db.orders, args.batch_size, args.reverse, args.report, args.limit)
+        title = "تقدير الحجم" if args.report else ("تمت العودة إلى الصيغة الكاملة" if args.reverse else "تم الترحيل")
+        report.print(title)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ترحيل الطلبات إلى صيغة التخزين المضغوطة")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--reverse", action="store_true", help="العودة إلى الصيغة الكاملة")
+    parser.add_argument("--report", action="store_true", help="حساب الحجم قبل وبعد دون تعديل")
+    parser.add_argument("--limit", type=int, default=0, help="عدد أقصى من الطلبات (0 = الكل)")
+    asyncio.run(main(parser.parse_args()))
@@ -1,9 +1,11 @@
-from pydantic import BaseModel, Field, EmailStr, validator
+from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 import uuid
 from enum import Enum
 
+import order_codec
+
 
 # =====================================================
 # ENUMS - تعدادات الحالات والأنواع
@@ -89,6 +91,18 @@ class User(UserBase):
     total_spent: float = Field(default=0.0, description="إجمالي المبلغ المنفق")
     loyalty_points: int = Field(default=0, description="نقاط الولاء")
 
+class UserLogin(BaseModel):
+    """نموذج تسجيل الدخول"""
+    email: EmailStr
+    password: str
+
+class TokenResponse(BaseModel):
+    """رمز الدخول الصادر بعد تسجيل الدخول"""
+    access_token: str
+    token_type: str = Field(default="bearer")
+    expires_in: int = Field(description="مدة الصلاحية بالثواني")
+    user: User
+
 
 # =====================================================
 # SERVICE MODELS - نماذج الخدمات
@@ -186,7 +200,7 @@ class OrderCreate(OrderBase):
 class Order(BaseModel):
     """نموذج الطلب الكامل"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    order_number: str = Field(description="رقم الطلب")
+    order_number: str = Field(description="رقم الطلب (يُخصص عبر order_numbers عند الإنشاء)")
     user_id: str
     customer_email: EmailStr
     customer_name: str
@@ -201,12 +215,39 @@ class Order(BaseModel):
     completed_at: Optional[datetime] = None
     delivery_time_estimate: Optional[datetime] = None
     notes: Optional[str] = None
-    
-    @validator('order_number', pre=True, always=True)
-    def generate_order_number(cls, v):
-        if not v:
-            return f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}-{str(uuid.uuid4())[:8].upper()}"
-        return v
+    version: int = Field(default=0, description="إصدار المستند للتحكم المتفائل بالتزامن")
+
+    @classmethod
+    def from_storage(cls, doc: Dict[str, Any]) -> "Order":
+        """بناء الطلب من مستند مخزن بالصيغة الكاملة أو المضغوطة"""
+        return cls(**order_codec.from_storage(doc))
+
+    def to_storage(self) -> Dict[str, Any]:
+        """مستند التخزين حسب إعداد ORDER_STORAGE_COMPACT"""
+        return order_codec.to_storage(self)
+
+class OrderTransition(BaseModel):
+    """طلب نقل حالة طلب واحد"""
+    status: OrderStatus
+    expected_version: Optional[int] = Field(default=None, description="رفض النقل إذا تغير الإصدار")
+
+class BulkOrderTransition(BaseModel):
+    """نقل حالة عدة طلبات دفعة واحدة"""
+    order_ids: List[str] = Field(min_length=1, max_length=10000)
+    status: OrderStatus
+
+class OrderTransitionConflict(BaseModel):
+    """طلب لم تُنقل حالته"""
+    order_id: str
+    reason: str = Field(description="not_found | invalid_transition | version_mismatch | concurrent_update")
+    status: Optional[OrderStatus] = None
+    version: Optional[int] = None
+
+class OrderTransitionResult(BaseModel):
+    """نتيجة نقل الحالة"""
+    status: OrderStatus
+    updated: List[str] = Field(default_factory=list)
+    conflicts: List[OrderTransitionConflict] = Field(default_factory=list)
 
 
 # =====================================================
@@ -297,6 +338,15 @@ class Notification(NotificationBase):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     read_at: Optional[datetime] = None
 
+class NotificationFanOut(BaseModel):
+    """إشعار واحد موجه إلى عدة مستخدمين"""
+    user_ids: List[str] = Field(min_length=1, max_length=10000)
+    title: str
+    title_ar: str
+    message: str
+    message_ar: str
+    type: str = Field(description="نوع الإشعار")
+
 
 # =====================================================
 # SYSTEM MODELS - نماذج النظام
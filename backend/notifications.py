@@ -0,0 +1,263 @@
+"""
+الإشعارات
+Notifications: batched fan-out, incremental unread counters and live stream
+
+الإشعارات الجديدة تُكتب دفعات عبر BatchWriter، وبعد كل دفعة يُحدّث عداد غير
+المقروء لكل مستخدم في مجموعة notification_counters بعملية $inc واحدة، فلا
+يحتاج شريط التنبيهات إلى count_documents عند كل استطلاع. العداد المفقود أو
+السالب أو المعلَّم stale (بعد فشل تحديثه إثر دفعة) يُعاد حسابه بـ count_documents
+مرة واحدة عند القراءة التالية.
+"""
+
+import logging
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pymongo import ReturnDocument, UpdateOne
+
+import auth
+from batch_writer import BatchWriter, OverflowPolicy
+from cache import TTLCache
+import database
+from events import SSE_HEADERS, EventHub, queue_events, sse_message
+from models import Notification, NotificationBase, NotificationFanOut, Order, UserRole
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_SIZE', '50000'))
+BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', '1000'))
+FLUSH_INTERVAL = float(os.environ.get('NOTIFICATION_FLUSH_INTERVAL', '0.25'))
+UNREAD_CACHE_TTL = float(os.environ.get('NOTIFICATION_UNREAD_CACHE_TTL', '5'))
+
+router = APIRouter(prefix="/notifications")
+
+hub = EventHub()
+unread_cache = TTLCache(maxsize=100_000, ttl=UNREAD_CACHE_TTL)
+writer: Optional[BatchWriter] = None
+
+_STAFF_ROLES = (UserRole.ADMIN.value, UserRole.SUPPORT.value)
+
+
+async def ensure_indexes(db) -> None:
+    """فهارس الإشعارات"""
+    await db.notifications.create_index("id", unique=True)
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+    await db.notifications.create_index([("user_id", 1), ("is_read", 1), ("created_at", -1)])
+
+
+async def start(db) -> None:
+    """تشغيل كاتب دفعات الإشعارات"""
+    global writer
+    writer = BatchWriter(
+        db.notifications,
+        max_queue_size=QUEUE_SIZE,
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+        overflow_policy=OverflowPolicy.BLOCK,
+        on_flush=_after_flush,
+    )
+    writer.start()
+
+
+async def stop() -> None:
+    """تفريغ الإشعارات المعلقة عند الإيقاف"""
+    global writer
+    if writer is not None:
+        await writer.stop()
+        writer = None
+
+
+async def _after_flush(batch: List[Dict[str, Any]]) -> None:
+    """تحديث العدادات وبث الإشعارات بعد كتابة الدفعة"""
+    per_user = Counter(doc["user_id"] for doc in batch)
+    try:
+        await database.db.notification_counters.bulk_write(
+            [UpdateOne({"_id": user_id}, {"$inc": {"unread": count}}, upsert=True)
+             for user_id, count in per_user.items()],
+            ordered=False,
+        )
+    except Exception:
+        logger.exception("فشل تحديث عدادات غير المقروء لـ %d مستخدم، ستُعاد مزامنتها", len(per_user))
+        await _invalidate_unread(list(per_user))
+    else:
+        for user_id, count in per_user.items():
+            _adjust_cached_unread(user_id, count)
+    for doc in batch:
+        if hub.has_subscribers(doc["user_id"]):
+            hub.publish(doc["user_id"], ("notification", Notification(**doc).model_dump(mode="json")))
+
+
+def _adjust_cached_unread(user_id: str, delta: int) -> None:
+    count = unread_cache.get(user_id)
+    if count is not None:
+        count = max(0, count + delta)
+        unread_cache.set(user_id, count)
+        hub.publish(user_id, ("unread_count", {"unread_count": count}))
+
+
+async def _invalidate_unread(user_ids: List[str]) -> None:
+    """تعليم العدادات التي لم يعد يُوثق بها لتُعاد مزامنتها عند القراءة التالية"""
+    for user_id in user_ids:
+        unread_cache.pop(user_id)
+    try:
+        await database.db.notification_counters.update_many(
+            {"_id": {"$in": user_ids}}, {"$set": {"stale": True}}
+        )
+    except Exception:
+        logger.exception("تعذر تعليم عدادات غير المقروء لإعادة مزامنتها")
+
+
+async def resync_unread_count(user_id: str) -> int:
+    """إعادة حساب عداد غير المقروء من مجموعة الإشعارات"""
+    count = await database.db.notifications.count_documents({"user_id": user_id, "is_read": False})
+    await database.db.notification_counters.update_one(
+        {"_id": user_id}, {"$set": {"unread": count}, "$unset": {"stale": ""}}, upsert=True
+    )
+    unread_cache.set(user_id, count)
+    return count
+
+
+async def get_unread_count(user_id: str) -> int:
+    """عدد الإشعارات غير المقروءة من الذاكرة المؤقتة أو من مستند العداد"""
+    count = unread_cache.get(user_id)
+    if count is None:
+        counter = await database.db.notification_counters.find_one({"_id": user_id})
+        if counter is None or counter.get("stale") or counter.get("unread", -1) < 0:
+            return await resync_unread_count(user_id)
+        count = counter["unread"]
+        unread_cache.set(user_id, count)
+    return count
+
+
+async def notify(notification: NotificationBase) -> Notification:
+    """إضافة إشعار إلى طابور الكتابة"""
+    if writer is None:
+        raise RuntimeError("كاتب الإشعارات غير مشغل")
+    full = Notification(**notification.model_dump())
+    await writer.put(full.model_dump())
+    return full
+
+
+async def notify_order_completed(order: Order) -> Notification:
+    """إشعار العميل باكتمال طلبه"""
+    return await notify(NotificationBase(
+        user_id=order.user_id,
+        title="Order completed",
+        title_ar="تم إكمال الطلب",
+        message=f"Your order {order.order_number} has been completed.",
+        message_ar=f"تم إكمال طلبك رقم {order.order_number}.",
+        type="order_completed",
+    ))
+
+
+# =====================================================
+# NOTIFICATIONS ENDPOINTS - نقاط نهاية الإشعارات
+# =====================================================
+
+@router.post("", response_model=Notification)
+async def create_notification(
+    notification: NotificationBase,
+    _: Dict[str, Any] = Depends(auth.require_roles(*_STAFF_ROLES))
+):
+    """إنشاء إشعار لمستخدم (يُكتب في الدفعة التالية)"""
+    return await notify(notification)
+
+
+@router.post("/fan-out")
+async def fan_out_notification(
+    fan_out: NotificationFanOut,
+    _: Dict[str, Any] = Depends(auth.require_roles(*_STAFF_ROLES))
+):
+    """إرسال الإشعار نفسه إلى عدة مستخدمين"""
+    content = fan_out.model_dump(exclude={"user_ids"})
+    for user_id in dict.fromkeys(fan_out.user_ids):
+        await notify(NotificationBase(user_id=user_id, **content))
+    return {"queued": len(set(fan_out.user_ids))}
+
+
+@router.get("", response_model=List[Notification])
+async def get_notifications(
+    unread_only: bool = False,
+    limit: int = Query(50, le=100),
+    user_id: str = Depends(auth.get_current_user_id)
+):
+    """إشعارات المستخدم الحالي"""
+    query: Dict[str, Any] = {"user_id": user_id}
+    if unread_only:
+        query["is_read"] = False
+    notifications = await database.db.notifications.find(query).sort("created_at", -1).limit(limit).to_list(limit)
+    return [Notification(**notification) for notification in notifications]
+
+
+@router.get("/unread-count")
+async def get_notifications_unread_count(user_id: str = Depends(auth.get_current_user_id)):
+    """عدد الإشعارات غير المقروءة"""
+    return {"unread_count": await get_unread_count(user_id)}
+
+
+@router.get("/stream")
+async def stream_notifications(user_id: str = Depends(auth.get_stream_user_id)):
+    """بث الإشعارات الجديدة وعدد غير المقروء عبر Server-Sent Events"""
+    async def event_stream():
+        # الاشتراك داخل المولد: إذا انقطع العميل قبل بدء البث لا يبقى طابور معلق
+        queue = hub.subscribe(user_id)
+        try:
+            last_count = await get_unread_count(user_id)
+            yield sse_message({"unread_count": last_count}, event="unread_count")
+            async for item in queue_events(queue):
+                if item is None:
+                    # النبض يعيد مزامنة العدد مع التغييرات القادمة من عمال آخرين
+                    count = await get_unread_count(user_id)
+                    if count != last_count:
+                        last_count = count
+                        yield sse_message({"unread_count": count}, event="unread_count")
+                    else:
+                        yield b": heartbeat\n\n"
+                    continue
+                event, data = item
+                if event == "unread_count":
+                    last_count = data["unread_count"]
+                yield sse_message(data, event=event)
+        finally:
+            hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/read-all")
+async def mark_all_notifications_read(user_id: str = Depends(auth.get_current_user_id)):
+    """تعليم جميع الإشعارات كمقروءة"""
+    result = await database.db.notifications.update_many(
+        {"user_id": user_id, "is_read": False},
+        {"$set": {"is_read": True, "read_at": datetime.utcnow()}},
+    )
+    if result.modified_count:
+        await database.db.notification_counters.update_one(
+            {"_id": user_id}, {"$inc": {"unread": -result.modified_count}}
+        )
+        _adjust_cached_unread(user_id, -result.modified_count)
+    return {"updated": result.modified_count}
+
+
+@router.post("/{notification_id}/read", response_model=Notification)
+async def mark_notification_read(notification_id: str, user_id: str = Depends(auth.get_current_user_id)):
+    """تعليم إشعار كمقروء"""
+    notification = await database.db.notifications.find_one_and_update(
+        {"id": notification_id, "user_id": user_id, "is_read": False},
+        {"$set": {"is_read": True, "read_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if notification:
+        await database.db.notification_counters.update_one({"_id": user_id}, {"$inc": {"unread": -1}})
+        _adjust_cached_unread(user_id, -1)
+        return Notification(**notification)
+
+    notification = await database.db.notifications.find_one({"id": notification_id, "user_id": user_id})
+    if not notification:
+        raise HTTPException(status_code=404, detail="الإشعار غير موجود")
+    return Notification(**notification)
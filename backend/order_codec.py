@@ -0,0 +1,177 @@
+"""
+ترميز مستندات الطلبات المضغوط
+Compact storage codec for orders
+
+يُخزن الطلب بصيغة مختصرة: المعرفات uuid كقيم BSON ثنائية (subtype 4) بدلاً من
+نص من 36 حرفاً، وأسماء مختصرة للحقول الثابتة والمكررة، ودون الحقول التي تحمل
+القيمة الافتراضية. الحقول المستخدمة في الاستعلامات والفهارس والتحديثات
+(id, order_number, user_id, status, created_at, updated_at, completed_at,
+total_amount, version) تبقى بأسمائها حتى تعمل الاستعلامات والتجميعات الحالية كما هي.
+
+from_storage يعيد دائماً القاموس بالصيغة الكاملة المتوافقة مع نموذج Order،
+سواء كان المستند مخزناً بالصيغة القديمة أو المضغوطة.
+"""
+
+import os
+import uuid
+from typing import Any, Dict, Iterable, Union
+
+from bson.binary import Binary, UuidRepresentation
+
+
+COMPACT_ORDERS = os.environ.get('ORDER_STORAGE_COMPACT', 'false').lower() == 'true'
+
+# علامة الصيغة المضغوطة ورقم إصدارها
+FORMAT_FIELD = "_f"
+FORMAT_VERSION = 1
+
+ORDER_ALIASES = {
+    "customer_email": "ce",
+    "customer_name": "cn",
+    "items": "it",
+    "subtotal": "st",
+    "discount_amount": "da",
+    "currency": "cu",
+    "delivery_time_estimate": "de",
+    "notes": "n",
+}
+
+ITEM_ALIASES = {
+    "id": "i",
+    "card_product_id": "p",
+    "quantity": "q",
+    "unit_price": "u",
+    "discount_applied": "d",
+    "card_codes": "c",
+}
+
+UUID_FIELDS = {"id", "user_id"}
+ITEM_UUID_FIELDS = {"id", "card_product_id"}
+
+# القيم الافتراضية التي لا تُخزن
+ORDER_DEFAULTS = {"discount_amount": 0.0, "currency": "USD", "version": 0}
+ITEM_DEFAULTS = {"discount_applied": 0.0, "card_codes": []}
+
+_ORDER_NAMES = {alias: name for name, alias in ORDER_ALIASES.items()}
+_ITEM_NAMES = {alias: name for name, alias in ITEM_ALIASES.items()}
+
+
+def encode_uuid(value: Any) -> Any:
+    """تحويل نص uuid إلى قيمة ثنائية؛ القيم الأخرى تبقى كما هي"""
+    if isinstance(value, str) and len(value) == 36:
+        try:
+            return Binary.from_uuid(uuid.UUID(value), UuidRepresentation.STANDARD)
+        except ValueError:
+            return value
+    return value
+
+
+def decode_uuid(value: Any) -> Any:
+    if isinstance(value, Binary) and value.subtype == 4:
+        return str(value.as_uuid(UuidRepresentation.STANDARD))
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def match_id(value: str) -> Union[str, Dict[str, Any]]:
+    """قيمة مرشح لمعرف uuid تطابق الصيغتين أثناء الترحيل وبعده"""
+    encoded = encode_uuid(value)
+    if encoded is value:
+        return value
+    return {"$in": [value, encoded]}
+
+
+def match_ids(values: Iterable[str]) -> Dict[str, Any]:
+    """مرشح $in لعدة معرفات بالصيغتين"""
+    matched = []
+    for value in values:
+        encoded = encode_uuid(value)
+        matched.append(value)
+        if encoded is not value:
+            matched.append(encoded)
+    return {"$in": matched}
+
+
+def projection(fields: Iterable[str]) -> Dict[str, int]:
+    """إسقاط يشمل الاسم الكامل والمختصر لكل حقل"""
+    result = {FORMAT_FIELD: 1}
+    for field in fields:
+        result[field] = 1
+        if field in ORDER_ALIASES:
+            result[ORDER_ALIASES[field]] = 1
+    return result
+
+
+def _is_default(value: Any, default: Any) -> bool:
+    return value == default and type(value) is type(default)
+
+
+def encode_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = {}
+    for name, value in item.items():
+        if value is None or (name in ITEM_DEFAULTS and _is_default(value, ITEM_DEFAULTS[name])):
+            continue
+        if name in ITEM_UUID_FIELDS:
+            value = encode_uuid(value)
+        encoded[ITEM_ALIASES.get(name, name)] = value
+    return encoded
+
+
+def decode_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    decoded = {}
+    for key, value in item.items():
+        name = _ITEM_NAMES.get(key, key)
+        decoded[name] = decode_uuid(value) if name in ITEM_UUID_FIELDS else value
+    for name, default in ITEM_DEFAULTS.items():
+        decoded.setdefault(name, list(default) if isinstance(default, list) else default)
+    return decoded
+
+
+def encode_order(order: Dict[str, Any]) -> Dict[str, Any]:
+    """تحويل قاموس الطلب الكامل إلى الصيغة المضغوطة"""
+    encoded: Dict[str, Any] = {FORMAT_FIELD: FORMAT_VERSION}
+    for name, value in order.items():
+        if name == FORMAT_FIELD:
+            continue
+        if name == "_id":
+            encoded[name] = value
+            continue
+        if value is None or (name in ORDER_DEFAULTS and _is_default(value, ORDER_DEFAULTS[name])):
+            continue
+        if name in UUID_FIELDS:
+            value = encode_uuid(value)
+        elif name == "items":
+            value = [encode_item(item) for item in value]
+        encoded[ORDER_ALIASES.get(name, name)] = value
+    return encoded
+
+
+def decode_order(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """تحويل مستند مضغوط إلى الصيغة الكاملة؛ المستندات القديمة تُعاد كما هي"""
+    if FORMAT_FIELD not in doc:
+        return doc
+    decoded = {}
+    for key, value in doc.items():
+        if key == FORMAT_FIELD:
+            continue
+        name = _ORDER_NAMES.get(key, key)
+        if name in UUID_FIELDS:
+            value = decode_uuid(value)
+        elif name == "items":
+            value = [decode_item(item) for item in value]
+        decoded[name] = value
+    for name, default in ORDER_DEFAULTS.items():
+        decoded.setdefault(name, default)
+    return decoded
+
+
+def to_storage(order) -> Dict[str, Any]:
+    """مستند التخزين لنموذج Order حسب الإعداد ORDER_STORAGE_COMPACT"""
+    data = order.model_dump()
+    return encode_order(data) if COMPACT_ORDERS else data
+
+
+def from_storage(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """قاموس متوافق مع Order من مستند مخزن بأي صيغة"""
+    return decode_order(doc)
@@ -0,0 +1,155 @@
+"""
+بث حالة الطلبات
+Shared order status watcher for Server-Sent Events
+
+مراقب واحد لكل عملية يتابع تغييرات حقل status في مجموعة orders عبر
+change stream ويوزعها على الاتصالات المشتركة. على خادم mongod مستقل (دون
+replica set) يتحول إلى استعلام دوري واحد يغطي كل الطلبات المشتركة معاً.
+
+الاشتراك يتم بمفتاح _id الخاص بالمستند حتى تكفي documentKey في حدث التغيير
+ولا حاجة إلى updateLookup لكل تحديث.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from events import EventHub
+
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.environ.get('ORDER_EVENTS_POLL_INTERVAL', '2.0'))
+MODE = os.environ.get('ORDER_EVENTS_MODE', 'auto')  # auto | polling
+RETRY_DELAY = 1.0
+
+# رموز أخطاء MongoDB عند عدم دعم change streams (خادم مستقل)
+_CHANGE_STREAM_UNSUPPORTED = {40573, 40324}
+
+
+class OrderStatusWatcher:
+    """مراقب تغييرات حالة الطلبات المشترك لكل العملية"""
+
+    def __init__(self, collection, poll_interval: float = POLL_INTERVAL):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.hub = EventHub(queue_size=8)
+        self.mode: Optional[str] = None
+        self._statuses: Dict[object, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, document_id, status: str) -> asyncio.Queue:
+        """الاشتراك في تغييرات طلب بمعرف المستند وحالته الحالية"""
+        self._statuses.setdefault(document_id, status)
+        return self.hub.subscribe(document_id)
+
+    def unsubscribe(self, document_id, queue: asyncio.Queue) -> None:
+        self.hub.unsubscribe(document_id, queue)
+        if not self.hub.has_subscribers(document_id):
+            self._statuses.pop(document_id, None)
+
+    def _publish(self, document_id, status: str, updated_at=None) -> None:
+        if self._statuses.get(document_id) == status:
+            return
+        self._statuses[document_id] = status
+        self.hub.publish(document_id, {"status": status, "updated_at": updated_at})
+
+    async def _run(self) -> None:
+        if MODE == "polling":
+            await self._poll()
+            return
+        while True:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                if e.code not in _CHANGE_STREAM_UNSUPPORTED:
+                    logger.exception("توقف مراقب حالة الطلبات، إعادة المحاولة")
+                    await asyncio.sleep(RETRY_DELAY)
+                    continue
+                logger.info("change streams غير مدعومة، سيتم استخدام الاستعلام الدوري")
+                await self._poll()
+            except Exception:
+                logger.exception("توقف مراقب حالة الطلبات، إعادة المحاولة")
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def _watch(self) -> None:
+        pipeline = [
+            {"$match": {"$or": [
+                {"operationType": "replace"},
+                {"operationType": "update", "updateDescription.updatedFields.status": {"$exists": True}},
+            ]}},
+            {"$project": {
+                "documentKey": 1,
+                "updateDescription.updatedFields.status": 1,
+                "updateDescription.updatedFields.updated_at": 1,
+                "fullDocument.status": 1,
+                "fullDocument.updated_at": 1,
+            }},
+        ]
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=resume_token) as stream:
+                    self.mode = "change_stream"
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document_id = change["documentKey"]["_id"]
+                        if not self.hub.has_subscribers(document_id):
+                            continue
+                        fields = change.get("fullDocument") or change["updateDescription"]["updatedFields"]
+                        self._publish(document_id, fields["status"], fields.get("updated_at"))
+            except OperationFailure as e:
+                if resume_token is None or e.code in _CHANGE_STREAM_UNSUPPORTED:
+                    raise
+                # رمز الاستئناف لم يعد صالحاً: البدء من الآن
+                logger.warning("تعذر استئناف change stream، البدء من جديد")
+                resume_token = None
+
+    async def _poll(self) -> None:
+        self.mode = "polling"
+        while True:
+            document_ids = list(self.hub.keys())
+            if document_ids:
+                try:
+                    cursor = self.collection.find(
+                        {"_id": {"$in": document_ids}},
+                        {"status": 1, "updated_at": 1},
+                    )
+                    async for doc in cursor:
+                        self._publish(doc["_id"], doc["status"], doc.get("updated_at"))
+                except PyMongoError:
+                    logger.exception("فشل الاستعلام الدوري عن حالة الطلبات")
+            await asyncio.sleep(self.poll_interval)
+
+
+watcher: Optional[OrderStatusWatcher] = None
+
+
+async def start(db) -> None:
+    """تشغيل المراقب المشترك"""
+    global watcher
+    watcher = OrderStatusWatcher(db.orders)
+    watcher.start()
+
+
+async def stop() -> None:
+    global watcher
+    if watcher is not None:
+        await watcher.stop()
+        watcher = None
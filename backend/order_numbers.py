@@ -0,0 +1,71 @@
+"""
+أرقام الطلبات
+Order number allocator backed by block-reserved Mongo counters
+
+كل عملية تحجز نطاقاً من الأرقام (ORDER_NUMBER_BLOCK_SIZE) بزيادة واحدة على
+مستند العداد، ثم توزعها من الذاكرة دون أي رحلة إلى قاعدة البيانات. الأرقام
+فريدة دائماً ومتزايدة داخل العملية الواحدة، ومبطنة بالأصفار فتُرتب نصياً.
+"""
+
+import asyncio
+import os
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+
+BLOCK_SIZE = int(os.environ.get('ORDER_NUMBER_BLOCK_SIZE', '100'))
+PREFIX = "ORD-"
+WIDTH = 12
+COUNTER_ID = "order_number"
+
+
+class OrderNumberAllocator:
+    """توزيع أرقام الطلبات من نطاقات محجوزة مسبقاً"""
+
+    def __init__(self, collection, block_size: int = BLOCK_SIZE, counter_id: str = COUNTER_ID):
+        self.collection = collection
+        self.block_size = block_size
+        self.counter_id = counter_id
+        # النطاق الحالي [_next, _end]؛ فارغ حتى أول حجز
+        self._next = 1
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _reserve(self) -> None:
+        counter = await self.collection.find_one_and_update(
+            {"_id": self.counter_id},
+            {"$inc": {"value": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._end = counter["value"]
+        self._next = self._end - self.block_size + 1
+
+    async def next_value(self) -> int:
+        """الرقم التالي كعدد صحيح"""
+        if self._next > self._end:
+            async with self._lock:
+                if self._next > self._end:
+                    await self._reserve()
+        value = self._next
+        self._next += 1
+        return value
+
+    async def next(self) -> str:
+        """رقم الطلب التالي بصيغة ORD-000000000001"""
+        return format_order_number(await self.next_value())
+
+
+def format_order_number(value: int) -> str:
+    return f"{PREFIX}{value:0{WIDTH}d}"
+
+
+allocator: Optional[OrderNumberAllocator] = None
+
+
+async def configure(db) -> None:
+    """تهيئة الموزع وفهرس تفرد أرقام الطلبات"""
+    global allocator
+    await db.orders.create_index("order_number", unique=True)
+    allocator = OrderNumberAllocator(db.counters)
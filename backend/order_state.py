@@ -0,0 +1,149 @@
+"""
+آلة حالات الطلبات
+Order state machine with optimistic concurrency and batched transitions
+
+كل انتقال مسموح معرّف في ALLOWED_TRANSITIONS. التحديث مشروط بالحالة والإصدار
+اللذين قُرئا (version يزيد مع كل انتقال)، فلا يطغى نقل جماعي من الإدارة على
+تحديث متزامن من عامل التنفيذ. الطلبات تُقرأ وتُحدث دفعات عبر bulk_write، وما
+لم يُطبق منها يُعاد كتعارض بدلاً من رحلة منفصلة لكل طلب.
+
+الطلبات القديمة بلا حقل version تُعامل كإصدار 0. الطلبات المؤرشفة (مثل
+delivered → refunded) تُحدث في مجموعة الأرشيف الشهرية التي تحتويها.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import archive
+import notifications
+import order_codec
+from models import Order, OrderStatus, OrderTransitionConflict, OrderTransitionResult
+
+
+TRANSITION_BATCH_SIZE = int(os.environ.get('ORDER_TRANSITION_BATCH_SIZE', '1000'))
+
+ALLOWED_TRANSITIONS: Dict[OrderStatus, FrozenSet[OrderStatus]] = {
+    OrderStatus.PENDING: frozenset({OrderStatus.PROCESSING, OrderStatus.CANCELLED}),
+    OrderStatus.PROCESSING: frozenset({OrderStatus.COMPLETED, OrderStatus.CANCELLED}),
+    OrderStatus.COMPLETED: frozenset({OrderStatus.DELIVERED, OrderStatus.REFUNDED}),
+    OrderStatus.DELIVERED: frozenset({OrderStatus.REFUNDED}),
+    OrderStatus.CANCELLED: frozenset(),
+    OrderStatus.REFUNDED: frozenset(),
+}
+
+_STATE_FIELDS = {"_id": 1, "id": 1, "status": 1, "version": 1}
+HOT_COLLECTION = "orders"
+
+
+def can_transition(current: str, target: str) -> bool:
+    return OrderStatus(target) in ALLOWED_TRANSITIONS[OrderStatus(current)]
+
+
+def version_filter(version: int) -> Any:
+    """مرشح الإصدار؛ الإصدار 0 يطابق أيضاً المستندات التي لا تحمل الحقل"""
+    return {"$in": [0, None]} if version == 0 else version
+
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _conflict(order_id: str, reason: str, doc: Optional[Dict[str, Any]] = None) -> OrderTransitionConflict:
+    if doc is None:
+        return OrderTransitionConflict(order_id=order_id, reason=reason)
+    return OrderTransitionConflict(
+        order_id=order_id, reason=reason, status=doc["status"], version=doc.get("version") or 0
+    )
+
+
+async def _load_states(db, order_ids: List[str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    """حالة كل طلب مع اسم المجموعة التي يوجد فيها: الساخنة أولاً ثم الأرشيف"""
+    states = {}
+    for chunk in _chunks(order_ids, TRANSITION_BATCH_SIZE):
+        async for doc in db[HOT_COLLECTION].find({"id": order_codec.match_ids(chunk)}, _STATE_FIELDS):
+            states[order_codec.decode_uuid(doc["id"])] = (HOT_COLLECTION, doc)
+
+    missing = [order_id for order_id in order_ids if order_id not in states]
+    for chunk in _chunks(missing, TRANSITION_BATCH_SIZE):
+        by_collection: Dict[str, List[str]] = defaultdict(list)
+        for order_id, name in (await archive.locate_archived_orders(db, chunk)).items():
+            by_collection[name].append(order_id)
+        for name, ids in by_collection.items():
+            async for doc in db[name].find({"id": order_codec.match_ids(ids)}, _STATE_FIELDS):
+                states[order_codec.decode_uuid(doc["id"])] = (name, doc)
+    return states
+
+
+async def _resolve_partial(collection, chunk: List[Tuple[str, Dict[str, Any]]], target: OrderStatus,
+                           result: OrderTransitionResult) -> None:
+    """إعادة قراءة دفعة لم تُطبق كاملة لمعرفة ما نُقل منها وما تعارض"""
+    current = {
+        doc["_id"]: doc
+        async for doc in collection.find({"_id": {"$in": [doc["_id"] for _, doc in chunk]}}, _STATE_FIELDS)
+    }
+    for order_id, before in chunk:
+        doc = current.get(before["_id"])
+        if doc is None:
+            result.conflicts.append(_conflict(order_id, "not_found"))
+        elif doc["status"] == target.value and doc.get("version") == (before.get("version") or 0) + 1:
+            result.updated.append(order_id)
+        else:
+            result.conflicts.append(_conflict(order_id, "concurrent_update", doc))
+
+
+async def _notify_completed(db, order_ids: List[str]) -> None:
+    # لا تُؤرشف إلا الحالات النهائية، فالطلبات المكتملة في المجموعة الساخنة دائماً
+    for chunk in _chunks(order_ids, TRANSITION_BATCH_SIZE):
+        async for doc in db[HOT_COLLECTION].find({"id": order_codec.match_ids(chunk)}):
+            await notifications.notify_order_completed(Order.from_storage(doc))
+
+
+async def transition_orders(db, order_ids: List[str], target: OrderStatus,
+                            expected_version: Optional[int] = None) -> OrderTransitionResult:
+    """نقل حالة الطلبات دفعات بتحديثات مشروطة وإرجاع ما نُقل وما تعارض"""
+    target = OrderStatus(target)
+    result = OrderTransitionResult(status=target)
+    order_ids = list(dict.fromkeys(order_ids))
+    states = await _load_states(db, order_ids)
+
+    candidates: Dict[str, List[Tuple[str, Dict[str, Any]]]] = defaultdict(list)
+    for order_id in order_ids:
+        name, doc = states.get(order_id, (None, None))
+        if doc is None:
+            result.conflicts.append(_conflict(order_id, "not_found"))
+        elif expected_version is not None and (doc.get("version") or 0) != expected_version:
+            result.conflicts.append(_conflict(order_id, "version_mismatch", doc))
+        elif not can_transition(doc["status"], target):
+            result.conflicts.append(_conflict(order_id, "invalid_transition", doc))
+        else:
+            candidates[name].append((order_id, doc))
+
+    now = datetime.utcnow()
+    changes = {"status": target.value, "updated_at": now}
+    if target == OrderStatus.COMPLETED:
+        changes["completed_at"] = now
+    update = {"$set": changes, "$inc": {"version": 1}}
+
+    for name, collection_candidates in candidates.items():
+        for chunk in _chunks(collection_candidates, TRANSITION_BATCH_SIZE):
+            operations = [
+                UpdateOne(
+                    {"_id": doc["_id"], "status": doc["status"], "version": version_filter(doc.get("version") or 0)},
+                    update,
+                )
+                for _, doc in chunk
+            ]
+            write = await db[name].bulk_write(operations, ordered=False)
+            if write.matched_count == len(operations):
+                result.updated.extend(order_id for order_id, _ in chunk)
+            else:
+                await _resolve_partial(db[name], chunk, target, result)
+
+    if target == OrderStatus.COMPLETED and result.updated:
+        await _notify_completed(db, result.updated)
+    return result
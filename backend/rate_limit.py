@@ -0,0 +1,302 @@
+"""
+تحديد المعدل وتخفيف الحمل
+Per-client rate limiting and load shedding
+
+لكل فئة مسارات (إنشاء الطلبات، انتقالات الحالة، التحليلات، الافتراضي) حد معدل بدلو رموز لكل
+عميل، وحد أقصى للطلبات المتزامنة، ورفض سريع عند تراكم الانتظار على مجمع
+اتصالات MongoDB حتى يبقى زمن الاستجابة محدوداً للعملاء الملتزمين.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from pymongo import ReturnDocument
+
+import auth
+from database import pool_monitor
+
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory | mongo
+RATE_LIMIT_SHARDS = int(os.environ.get('RATE_LIMIT_SHARDS', '64'))
+RATE_LIMIT_MAX_KEYS_PER_SHARD = int(os.environ.get('RATE_LIMIT_MAX_KEYS_PER_SHARD', '2048'))
+TRUST_FORWARDED_FOR = os.environ.get('TRUST_FORWARDED_FOR', 'false').lower() == 'true'
+MAX_POOL_WAITERS = int(os.environ.get('MAX_POOL_WAITERS', '50'))
+# مفاتيح API المعتمدة (مفصولة بفواصل)؛ المفتاح غير المعتمد يُتجاهل ولا يصبح مفتاح دلو
+API_KEYS = frozenset(key.strip() for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if key.strip())
+
+
+def _env_number(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+@dataclass
+class RouteClass:
+    """فئة مسارات بحدودها"""
+    name: str
+    rate: float              # رموز في الثانية لكل عميل
+    burst: float             # سعة الدلو
+    max_concurrent: int      # الحد الأقصى للطلبات المتزامنة في العامل
+    max_waiting: int         # الحد الأقصى للطلبات المنتظرة قبل الرفض
+    queue_timeout: float     # أقصى مدة انتظار بالثواني
+    shed_on_pool_wait: bool  # الرفض عند تراكم الانتظار على مجمع الاتصالات
+
+
+def _route_class(name: str, rate: float, burst: float, max_concurrent: int, shed_on_pool_wait: bool) -> RouteClass:
+    prefix = name.upper()
+    return RouteClass(
+        name=name,
+        rate=_env_number(f'RATE_LIMIT_{prefix}_RATE', rate),
+        burst=_env_number(f'RATE_LIMIT_{prefix}_BURST', burst),
+        max_concurrent=int(_env_number(f'CONCURRENCY_{prefix}_MAX', max_concurrent)),
+        max_waiting=int(_env_number(f'CONCURRENCY_{prefix}_MAX_WAITING', max_concurrent)),
+        queue_timeout=_env_number(f'CONCURRENCY_{prefix}_QUEUE_TIMEOUT', 0.5),
+        shed_on_pool_wait=shed_on_pool_wait,
+    )
+
+
+ROUTE_CLASSES: Dict[str, RouteClass] = {
+    "orders_write": _route_class("orders_write", rate=2, burst=10, max_concurrent=64, shed_on_pool_wait=True),
+    # انتقالات الحالة من الإدارة وعمال التنفيذ: طلب لكل طلب شراء، فالمعدل أعلى بكثير من إنشاء الطلبات
+    "order_transitions": _route_class("order_transitions", rate=50, burst=200, max_concurrent=32,
+                                      shed_on_pool_wait=True),
+    "analytics": _route_class("analytics", rate=0.5, burst=5, max_concurrent=8, shed_on_pool_wait=True),
+    "default": _route_class("default", rate=20, burst=100, max_concurrent=512, shed_on_pool_wait=False),
+    # اتصالات البث طويلة العمر: يُحد معدل فتحها لا عددها المتزامن
+    "streams": _route_class("streams", rate=1, burst=10, max_concurrent=100_000, shed_on_pool_wait=False),
+}
+
+STREAM_SUFFIXES = ("/stream", "/events")
+
+# (الطريقة، نمط بداية المسار، الفئة) - أول تطابق يُعتمد
+ROUTE_RULES: List[Tuple[Optional[str], Pattern[str], str]] = [
+    ("POST", re.compile(r"/api/orders/(transitions|[^/]+/transition)$"), "order_transitions"),
+    ("POST", re.compile(r"/api/orders"), "orders_write"),
+    (None, re.compile(r"/api/analytics"), "analytics"),
+]
+
+
+def classify(method: str, path: str) -> RouteClass:
+    """تحديد فئة المسار"""
+    if path.endswith(STREAM_SUFFIXES):
+        return ROUTE_CLASSES["streams"]
+    for rule_method, pattern, name in ROUTE_RULES:
+        if (rule_method is None or rule_method == method) and pattern.match(path):
+            return ROUTE_CLASSES[name]
+    return ROUTE_CLASSES["default"]
+
+
+# =====================================================
+# BACKENDS - مخازن العدادات
+# =====================================================
+
+class RateLimitBackend(ABC):
+    """واجهة مخزن حدود المعدل"""
+
+    @abstractmethod
+    async def acquire(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        """استهلاك رمز؛ يعيد (مسموح، ثواني الانتظار المقترحة)"""
+
+
+class InMemoryBackend(RateLimitBackend):
+    """دلاء رموز داخل العملية موزعة على أجزاء لتقليل كلفة التنظيف"""
+
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, max_keys_per_shard: int = RATE_LIMIT_MAX_KEYS_PER_SHARD):
+        self.max_keys_per_shard = max_keys_per_shard
+        self._shards: List[Dict[str, List[float]]] = [{} for _ in range(shards)]
+
+    async def acquire(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        shard = self._shards[hash(key) % len(self._shards)]
+        now = time.monotonic()
+        bucket = shard.get(key)
+        if bucket is None:
+            if len(shard) >= self.max_keys_per_shard:
+                self._evict(shard, now, burst / rate if rate > 0 else 0)
+            bucket = shard[key] = [burst, now]
+
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True, 0.0
+        bucket[0] = tokens
+        return False, (1 - tokens) / rate
+
+    def _evict(self, shard: Dict[str, List[float]], now: float, refill_seconds: float) -> None:
+        # الدلاء التي امتلأت مجدداً لا تحمل أي حالة ويمكن حذفها
+        for key in [k for k, (_, last) in shard.items() if now - last >= refill_seconds]:
+            del shard[key]
+        if len(shard) >= self.max_keys_per_shard:
+            # لم يُحذف ما يكفي: إسقاط الأقدم إدراجاً
+            for key in list(shard)[: max(1, len(shard) // 8)]:
+                del shard[key]
+
+
+class MongoBackend(RateLimitBackend):
+    """عدادات نوافذ زمنية مشتركة بين العمال في MongoDB (تقريب لدلو الرموز)"""
+
+    def __init__(self, collection, window_seconds: float = 1.0):
+        self.collection = collection
+        self.window_seconds = window_seconds
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def acquire(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        # نافذة تتسع للسعة كاملة، فيبقى المعدل المتوسط rate والدفعة القصوى burst
+        window = max(self.window_seconds, burst / rate if rate > 0 else self.window_seconds)
+        now = time.time()
+        window_start = math.floor(now / window) * window
+        doc = await self.collection.find_one_and_update(
+            {"_id": f"{key}:{window_start:.0f}"},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {"expires_at": datetime.utcfromtimestamp(window_start + window * 2)},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["count"] <= burst:
+            return True, 0.0
+        return False, window_start + window - now
+
+
+# =====================================================
+# CONCURRENCY - حدود التزامن
+# =====================================================
+
+class ConcurrencyLimiter:
+    """حد أقصى للطلبات المتزامنة مع طابور انتظار محدود ومهلة قصيرة"""
+
+    def __init__(self, max_concurrent: int, max_waiting: int, queue_timeout: float):
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.waiting = 0
+
+    async def acquire(self) -> bool:
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return True
+        if self.waiting >= self.max_waiting:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+
+# =====================================================
+# MIDDLEWARE - الوسيط
+# =====================================================
+
+backend: RateLimitBackend = InMemoryBackend()
+
+
+async def configure(db) -> None:
+    """اختيار مخزن العدادات عند بدء التشغيل"""
+    global backend
+    if RATE_LIMIT_BACKEND == "mongo":
+        backend = MongoBackend(db.rate_limits)
+        await backend.ensure_indexes()
+    else:
+        backend = InMemoryBackend()
+
+
+def client_key(scope) -> str:
+    """مفتاح العميل: مفتاح API معتمد ثم المستخدم من رمز JWT ثم عنوان IP"""
+    api_key = None
+    authorization = None
+    forwarded_for = None
+    for name, value in scope.get("headers", ()):
+        if name == b"x-api-key":
+            api_key = value.decode("latin-1")
+        elif name == b"authorization":
+            authorization = value.decode("latin-1")
+        elif name == b"x-forwarded-for":
+            forwarded_for = value.decode("latin-1")
+
+    # مفتاح غير معتمد لا يُقبل، وإلا لتجاوز العميل الحد بتغيير المفتاح مع كل طلب
+    if api_key and api_key in API_KEYS:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    if authorization and authorization[:7].lower() == "bearer ":
+        try:
+            return "user:" + auth.decode_access_token(authorization[7:])["sub"]
+        except Exception:
+            pass
+
+    if TRUST_FORWARDED_FOR and forwarded_for:
+        return "ip:" + forwarded_for.split(",")[0].strip()
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+async def _reject(send, status_code: int, detail: str, retry_after: float) -> None:
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """وسيط ASGI لحدود المعدل والتزامن وتخفيف الحمل"""
+
+    def __init__(self, app, path_prefix: str = "/api"):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.limiters = {
+            name: ConcurrencyLimiter(rc.max_concurrent, rc.max_waiting, rc.queue_timeout)
+            for name, rc in ROUTE_CLASSES.items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        if (not RATE_LIMIT_ENABLED or scope["type"] != "http" or scope["method"] == "OPTIONS"
+                or not scope["path"].startswith(self.path_prefix)):
+            await self.app(scope, receive, send)
+            return
+
+        route_class = classify(scope["method"], scope["path"])
+
+        allowed, retry_after = await backend.acquire(
+            f"{route_class.name}:{client_key(scope)}", route_class.rate, route_class.burst
+        )
+        if not allowed:
+            await _reject(send, 429, "تم تجاوز الحد المسموح من الطلبات", retry_after)
+            return
+
+        if route_class.shed_on_pool_wait and pool_monitor.waiting > MAX_POOL_WAITERS:
+            await _reject(send, 503, "الخادم مشغول، يرجى المحاولة لاحقاً", 1)
+            return
+
+        limiter = self.limiters[route_class.name]
+        if not await limiter.acquire():
+            await _reject(send, 503, "الخادم مشغول، يرجى المحاولة لاحقاً", limiter.queue_timeout)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -0,0 +1,347 @@
+"""
+توصيات البطاقات
+Card recommendations from a precomputed co-purchase matrix
+
+مهمة دورية تمسح عناصر الطلبات المكتملة دفعات من الأرشيف والمجموعة الساخنة
+مدمجين بترتيب created_at، وتبني بـ pandas مصفوفة شراء مشترك متفرقة: لكل بطاقة
+عدد الطلبات التي اشتُريت فيها مع كل بطاقة أخرى. العدادات تُضاف بـ $inc إلى مجموعة recommendations، فكل
+تشغيل يعالج فقط الطلبات الأحدث من آخر created_at معالج.
+
+كل مستند بطاقة يحفظ created_at آخر دفعة أُضيفت إليه (until) في التحديث نفسه،
+فإعادة دفعة بعد توقف قبل حفظ نقطة التقدم لا تعدّ طلباتها مرتين. القفل يُجدد مع
+نقطة التقدم بعد كل دفعة، ويتوقف التشغيل إذا أخذه عامل آخر.
+
+حد معروف: نقطة التقدم على created_at، فالطلب الذي يكتمل بعد أكثر من
+RECOMMENDATIONS_SETTLE_MINUTES من إنشائه لا يُحتسب إلا عند --rebuild.
+
+النتائج (أكثر البطاقات شراءً معها، والأكثر مبيعاً لكل خدمة وإجمالاً) تُحمّل في
+الذاكرة وتُقدم دون أي تجميع لكل طلب.
+
+أمثلة:
+    python recommendations.py            # معالجة الطلبات الجديدة
+    python recommendations.py --rebuild  # إعادة البناء من البداية
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import archive
+import order_codec
+from models import OrderStatus
+
+
+logger = logging.getLogger(__name__)
+
+TOP_N = int(os.environ.get('RECOMMENDATIONS_TOP_N', '10'))
+BATCH_SIZE = int(os.environ.get('RECOMMENDATIONS_BATCH_SIZE', '5000'))
+INTERVAL_MINUTES = float(os.environ.get('RECOMMENDATIONS_INTERVAL_MINUTES', '60'))  # 0 = تعطيل الجدولة
+# الطلبات الأحدث من هذه المدة لم تستقر حالتها بعد فتُترك للتشغيل التالي
+SETTLE_MINUTES = float(os.environ.get('RECOMMENDATIONS_SETTLE_MINUTES', '60'))
+LEASE_MINUTES = 30
+
+COLLECTION = "recommendations"
+STATE_ID = "state"
+TOP_ID = "top"
+COUNTED_STATUSES = [OrderStatus.COMPLETED.value, OrderStatus.DELIVERED.value]
+
+_ITEM_FIELDS = {
+    "created_at": 1,
+    order_codec.FORMAT_FIELD: 1,
+    "items.card_product_id": 1,
+    "items.quantity": 1,
+    "it.p": 1,
+    "it.q": 1,
+}
+
+
+async def ensure_indexes(db) -> None:
+    await db[COLLECTION].create_index("kind")
+
+
+# =====================================================
+# BUILD - بناء المصفوفة
+# =====================================================
+
+class LeaseLost(Exception):
+    """أخذ عامل آخر قفل المهمة بعد انتهاء مدته"""
+
+
+def _empty_rows() -> Dict[str, List[Any]]:
+    return {"order": [], "card": [], "quantity": [], "created_at": []}
+
+
+def co_purchase_counts(rows: Dict[str, List[Any]], applied: Optional[Dict[str, datetime]] = None):
+    """عدادات الشراء المشترك والكميات المباعة لدفعة من عناصر الطلبات
+
+    applied: created_at آخر دفعة أُضيفت لكل بطاقة؛ الطلبات حتى هذا الوقت لا تُحتسب لها
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame(rows, columns=["order", "card", "quantity", "created_at"])
+    baskets = frame.drop_duplicates(["order", "card"])
+    pairs = baskets[["order", "card", "created_at"]].merge(baskets[["order", "card"]], on="order")
+    pairs = pairs[pairs["card_x"] != pairs["card_y"]]
+    if applied:
+        frame = frame[~(pd.to_datetime(frame["card"].map(applied)) >= frame["created_at"])]
+        pairs = pairs[~(pd.to_datetime(pairs["card_x"].map(applied)) >= pairs["created_at"])]
+    sold = frame.groupby("card")["quantity"].sum()
+    counts = pairs.groupby(["card_x", "card_y"]).size()
+    return counts, sold
+
+
+async def _apply_batch(db, rows: Dict[str, List[Any]], last_created_at: datetime, owner: str) -> None:
+    card_ids = [f"card:{card}" for card in set(rows["card"])]
+    applied = {
+        doc["card_id"]: doc["until"]
+        async for doc in db[COLLECTION].find({"_id": {"$in": card_ids}, "until": {"$ne": None}}, {"card_id": 1, "until": 1})
+    }
+    counts, sold = co_purchase_counts(rows, applied)
+    increments: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for card, quantity in sold.items():
+        increments[card]["sold"] = int(quantity)
+    for (card, other), count in counts.items():
+        increments[card][f"co.{other}"] = int(count)
+    if increments:
+        await db[COLLECTION].bulk_write(
+            [UpdateOne({"_id": f"card:{card}"},
+                       {"$inc": inc, "$set": {"kind": "card", "card_id": card, "until": last_created_at}}, upsert=True)
+             for card, inc in increments.items()],
+            ordered=False,
+        )
+    await _renew_lease(db, owner, last_created_at=last_created_at)
+    await _update_related(db, list(increments))
+
+
+async def _update_related(db, cards: List[str]) -> None:
+    """إعادة حساب قائمة أكثر N بطاقة للبطاقات التي تغيرت عداداتها"""
+    operations = []
+    async for row in db[COLLECTION].find({"_id": {"$in": [f"card:{card}" for card in cards]}}, {"co": 1}):
+        ranked = sorted(row.get("co", {}).items(), key=lambda item: (-item[1], item[0]))[:TOP_N]
+        operations.append(UpdateOne(
+            {"_id": row["_id"]},
+            {"$set": {"related": [{"card_id": card, "count": count} for card, count in ranked]}},
+        ))
+    if operations:
+        await db[COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def _update_top_sellers(db) -> None:
+    """الأكثر مبيعاً لكل خدمة وإجمالاً"""
+    sold = {row["card_id"]: row.get("sold", 0)
+            async for row in db[COLLECTION].find({"kind": "card"}, {"card_id": 1, "sold": 1})}
+    cards = {card["id"]: card async for card in db.card_products.find(
+        {"id": {"$in": list(sold)}}, {"_id": 0, "id": 1, "service_id": 1, "name": 1, "name_ar": 1}
+    )}
+
+    def entry(card_id: str) -> Dict[str, Any]:
+        card = cards[card_id]
+        return {"card_id": card_id, "name": card.get("name"), "name_ar": card.get("name_ar"), "sold": sold[card_id]}
+
+    ranked = sorted((card_id for card_id in sold if card_id in cards), key=lambda card_id: (-sold[card_id], card_id))
+    by_service: Dict[str, List[str]] = defaultdict(list)
+    for card_id in ranked:
+        by_service[cards[card_id]["service_id"]].append(card_id)
+
+    now = datetime.utcnow()
+    operations = [UpdateOne(
+        {"_id": TOP_ID}, {"$set": {"kind": "top", "top": [entry(c) for c in ranked[:TOP_N]], "updated_at": now}}, upsert=True
+    )]
+    for service_id, card_ids in by_service.items():
+        operations.append(UpdateOne(
+            {"_id": f"service:{service_id}"},
+            {"$set": {"kind": "service", "service_id": service_id, "top": [entry(c) for c in card_ids[:TOP_N]],
+                      "updated_at": now}},
+            upsert=True,
+        ))
+    # البطاقة تُنسب لخدمتها في الذاكرة لاختيار البديل عند غياب بيانات الشراء المشترك
+    operations.extend(
+        UpdateOne({"_id": f"card:{card_id}"}, {"$set": {"service_id": cards[card_id]["service_id"]}})
+        for card_id in ranked
+    )
+    await db[COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def _acquire_lease(db, owner: str) -> Optional[Dict[str, Any]]:
+    """قفل حتى لا يعالج عاملان الطلبات نفسها مرتين"""
+    now = datetime.utcnow()
+    try:
+        return await db[COLLECTION].find_one_and_update(
+            {"_id": STATE_ID, "$or": [{"lease_until": {"$lt": now}}, {"lease_until": None}]},
+            {"$set": {"kind": "state", "lease_until": now + timedelta(minutes=LEASE_MINUTES), "owner": owner}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+
+
+async def _renew_lease(db, owner: str, **fields: Any) -> None:
+    """تمديد القفل مع حفظ نقطة التقدم؛ يفشل إذا لم يعد القفل لهذا التشغيل"""
+    result = await db[COLLECTION].update_one(
+        {"_id": STATE_ID, "owner": owner},
+        {"$set": {"lease_until": datetime.utcnow() + timedelta(minutes=LEASE_MINUTES), **fields}},
+    )
+    if not result.matched_count:
+        raise LeaseLost(owner)
+
+
+async def build(db, batch_size: int = BATCH_SIZE) -> int:
+    """معالجة الطلبات الجديدة منذ آخر تشغيل؛ يعيد عدد الطلبات المعالجة"""
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    state = await _acquire_lease(db, owner)
+    if state is None:
+        logger.info("مهمة التوصيات تعمل في عملية أخرى")
+        return 0
+
+    try:
+        start = state.get("last_created_at")
+        cutoff = datetime.utcnow() - timedelta(minutes=SETTLE_MINUTES)
+        created_at = {"$lt": cutoff}
+        if start is not None:
+            created_at["$gt"] = start
+        query = {"status": {"$in": COUNTED_STATUSES}, "created_at": created_at}
+
+        total = 0
+        rows = _empty_rows()
+        batch_orders = 0
+        last_created_at = None
+        async for doc in archive.iter_orders(db, query, start, cutoff, projection=_ITEM_FIELDS):
+            # الدفعة تُغلق عند تغير created_at حتى لا تنقسم طلبات اللحظة نفسها بين تشغيلين
+            if batch_orders >= batch_size and doc["created_at"] != last_created_at:
+                await _apply_batch(db, rows, last_created_at, owner)
+                rows = _empty_rows()
+                batch_orders = 0
+            order = order_codec.from_storage(doc)
+            for item in order.get("items", []):
+                rows["order"].append(total)
+                rows["card"].append(item["card_product_id"])
+                rows["quantity"].append(item.get("quantity", 1))
+                rows["created_at"].append(doc["created_at"])
+            batch_orders += 1
+            total += 1
+            last_created_at = doc["created_at"]
+        if batch_orders:
+            await _apply_batch(db, rows, last_created_at, owner)
+
+        if total or start is None:
+            await _update_top_sellers(db)
+        logger.info("التوصيات: عولج %d طلب", total)
+        return total
+    except LeaseLost:
+        logger.warning("انتهى قفل مهمة التوصيات وأخذه عامل آخر، أُوقف التشغيل")
+        return 0
+    finally:
+        await db[COLLECTION].update_one({"_id": STATE_ID, "owner": owner}, {"$unset": {"lease_until": "", "owner": ""}})
+
+
+async def reset(db) -> None:
+    """حذف كل التوصيات والبدء من أول طلب"""
+    await db[COLLECTION].delete_many({})
+
+
+# =====================================================
+# SERVING - التقديم من الذاكرة
+# =====================================================
+
+_related: Dict[str, List[str]] = {}
+_card_services: Dict[str, str] = {}
+_service_top: Dict[str, List[str]] = {}
+_top_selling: List[Dict[str, Any]] = []
+
+
+async def load(db) -> None:
+    """تحميل التوصيات إلى الذاكرة"""
+    global _related, _card_services, _service_top, _top_selling
+    related, card_services, service_top, top_selling = {}, {}, {}, []
+    async for doc in db[COLLECTION].find({}, {"co": 0}):
+        kind = doc.get("kind")
+        if kind == "card":
+            related[doc["card_id"]] = [entry["card_id"] for entry in doc.get("related", [])]
+            if doc.get("service_id"):
+                card_services[doc["card_id"]] = doc["service_id"]
+        elif kind == "service":
+            service_top[doc["service_id"]] = [entry["card_id"] for entry in doc.get("top", [])]
+        elif kind == "top":
+            top_selling = doc.get("top", [])
+    _related, _card_services, _service_top, _top_selling = related, card_services, service_top, top_selling
+
+
+def recommended_card_ids(card_id: str, limit: int = TOP_N) -> List[str]:
+    """البطاقات المشتراة مع البطاقة، أو الأكثر مبيعاً في خدمتها ثم إجمالاً"""
+    card_ids = _related.get(card_id)
+    if not card_ids:
+        service_id = _card_services.get(card_id)
+        card_ids = _service_top.get(service_id) or [entry["card_id"] for entry in _top_selling]
+    return [other for other in card_ids if other != card_id][:limit]
+
+
+def top_selling_cards() -> List[Dict[str, Any]]:
+    return list(_top_selling)
+
+
+# =====================================================
+# SCHEDULER - الجدولة
+# =====================================================
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run_periodically(db) -> None:
+    while True:
+        await asyncio.sleep(INTERVAL_MINUTES * 60)
+        try:
+            await build(db)
+            await load(db)
+        except Exception:
+            logger.exception("فشل تحديث التوصيات")
+
+
+async def start(db) -> None:
+    """تحميل التوصيات وتشغيل التحديث الدوري إذا ضُبط RECOMMENDATIONS_INTERVAL_MINUTES"""
+    global _task
+    await load(db)
+    if INTERVAL_MINUTES > 0:
+        _task = asyncio.create_task(_run_periodically(db))
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+async def main(args) -> None:
+    import database
+
+    db = database.connect()
+    try:
+        await ensure_indexes(db)
+        if args.rebuild:
+            await reset(db)
+        processed = await build(db, args.batch_size)
+        print(f"🛒 تمت معالجة {processed} طلب للتوصيات")
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="بناء توصيات البطاقات من الطلبات")
+    parser.add_argument("--rebuild", action="store_true", help="إعادة البناء من أول طلب")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
@@ -1,58 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.responses import StreamingResponse
 import os
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
 from datetime import datetime, timedelta
 
-# استيراد النماذج الجديدة
 from models import (
-    # User models
-    User, UserCreate, UserUpdate,
-    # Service models  
-    Service, ServiceBase, ServiceType,
-    # Card models
-    CardProduct, CardProductBase, CardProvider,
-    # Order models
+    UserRole,
+    Service, ServiceType,
+    CardProduct, CardProvider,
     Order, OrderCreate, OrderStatus,
-    # Payment models
-    Payment, PaymentBase, PaymentStatus,
-    # Review models
-    Review, ReviewBase,
-    # Analytics models
-    ServiceStats, DashboardMetrics,
-    # System models
-    SystemSettings, ActivityLog
+    OrderTransition, BulkOrderTransition, OrderTransitionResult,
+    DashboardMetrics,
 )
+import activity_log
+import archive
+import auth
+import database
+import notifications
+import order_codec
+import order_events
+import order_numbers
+import order_state
+import rate_limit
+import recommendations
+import users
+from events import SSE_HEADERS, queue_events, sse_message
 
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
-
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Create the main app without a prefix
-app = FastAPI()
-
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
-
-
-# Create the main app without a prefix
-app = FastAPI(
-    title="خدمات البطاقات الرقمية",
-    description="منصة شاملة لبيع وإدارة البطاقات الرقمية مسبقة الدفع",
-    version="1.0.0"
-)
-
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -71,13 +49,13 @@ async def get_services(
     if service_type:
         query["service_type"] = service_type
     
-    services = await db.services.find(query).sort("display_order", 1).to_list(100)
+    services = await database.db.services.find(query).sort("display_order", 1).to_list(100)
     return [Service(**service) for service in services]
 
 @api_router.get("/services/{service_id}", response_model=Service)
 async def get_service(service_id: str):
     """الحصول على تفاصيل خدمة محددة"""
-    service = await db.services.find_one({"id": service_id})
+    service = await database.db.services.find_one({"id": service_id})
     if not service:
         raise HTTPException(status_code=404, detail="الخدمة غير موجودة")
     return Service(**service)
@@ -110,17 +88,27 @@ async def get_card_products(
         else:
             query["price"] = {"$lte": max_price}
     
-    cards = await db.card_products.find(query).sort("total_sold", -1).to_list(100)
+    cards = await database.db.card_products.find(query).sort("total_sold", -1).to_list(100)
     return [CardProduct(**card) for card in cards]
 
 @api_router.get("/cards/{card_id}", response_model=CardProduct)
 async def get_card_product(card_id: str):
     """الحصول على تفاصيل بطاقة محددة"""
-    card = await db.card_products.find_one({"id": card_id})
+    card = await database.db.card_products.find_one({"id": card_id})
     if not card:
         raise HTTPException(status_code=404, detail="البطاقة غير موجودة")
     return CardProduct(**card)
 
+@api_router.get("/cards/{card_id}/recommendations", response_model=List[CardProduct])
+async def get_card_recommendations(card_id: str, limit: int = Query(10, ge=1, le=50)):
+    """بطاقات يشتريها العملاء عادة مع هذه البطاقة (من التوصيات المحسوبة مسبقاً)"""
+    card_ids = recommendations.recommended_card_ids(card_id, limit)
+    if not card_ids:
+        return []
+    cards = await database.db.card_products.find({"id": {"$in": card_ids}, "is_available": True}).to_list(len(card_ids))
+    by_id = {card["id"]: CardProduct(**card) for card in cards}
+    return [by_id[other] for other in card_ids if other in by_id]
+
 
 # =====================================================
 # ORDERS ENDPOINTS - نقاط نهاية الطلبات
@@ -135,7 +123,7 @@ async def create_order(order_data: OrderCreate):
     
     for item_data in order_data.items:
         # التحقق من وجود البطاقة
-        card = await db.card_products.find_one({"id": item_data.card_product_id})
+        card = await database.db.card_products.find_one({"id": item_data.card_product_id})
         if not card:
             raise HTTPException(status_code=404, detail=f"البطاقة غير موجودة: {item_data.card_product_id}")
         
@@ -151,6 +139,7 @@ async def create_order(order_data: OrderCreate):
     
     # إنشاء الطلب
     order = Order(
+        order_number=await order_numbers.allocator.next(),
         user_id=order_data.user_id,
         customer_email=order_data.customer_email,
         customer_name=order_data.customer_name,
@@ -161,7 +150,7 @@ async def create_order(order_data: OrderCreate):
         delivery_time_estimate=datetime.utcnow() + timedelta(minutes=5)
     )
     
-    await db.orders.insert_one(order.dict())
+    await database.db.orders.insert_one(order.to_storage())
     return order
 
 @api_router.get("/orders", response_model=List[Order])
@@ -173,20 +162,138 @@ async def get_orders(
     """الحصول على قائمة الطلبات"""
     query = {}
     if user_id:
-        query["user_id"] = user_id
+        query["user_id"] = order_codec.match_id(user_id)
     if status:
         query["status"] = status
     
-    orders = await db.orders.find(query).sort("created_at", -1).limit(limit).to_list(limit)
-    return [Order(**order) for order in orders]
+    orders = await database.db.orders.find(query).sort("created_at", -1).limit(limit).to_list(limit)
+    return [Order.from_storage(order) for order in orders]
+
+@api_router.get("/orders/export")
+async def export_orders(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    status: Optional[OrderStatus] = None,
+    _: dict = Depends(auth.require_roles(UserRole.ADMIN.value, UserRole.SUPPORT.value))
+):
+    """تصدير الطلبات بصيغة NDJSON من الأرشيف والمجموعة الساخنة معاً"""
+    query = {}
+    if start or end:
+        query["created_at"] = {}
+        if start:
+            query["created_at"]["$gte"] = start
+        if end:
+            query["created_at"]["$lt"] = end
+    if user_id:
+        query["user_id"] = order_codec.match_id(user_id)
+    if status:
+        query["status"] = status
+
+    async def lines():
+        async for doc in archive.iter_orders(database.db, query, start, end):
+            yield Order.from_storage(doc).model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str):
-    """الحصول على تفاصيل طلب محدد"""
-    order = await db.orders.find_one({"id": order_id})
+    """الحصول على تفاصيل طلب محدد (من الأرشيف إذا نُقل إليه)"""
+    order = await database.db.orders.find_one({"id": order_codec.match_id(order_id)})
+    if not order:
+        order = await archive.find_archived_order(database.db, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="الطلب غير موجود")
+    return Order.from_storage(order)
+
+_TRANSITION_ERRORS = {
+    "not_found": (404, "الطلب غير موجود"),
+    "invalid_transition": (409, "لا يمكن نقل الطلب إلى هذه الحالة"),
+    "version_mismatch": (409, "تم تعديل الطلب منذ قراءته، أعد المحاولة"),
+    "concurrent_update": (409, "تم تعديل الطلب منذ قراءته، أعد المحاولة"),
+}
+
+@api_router.post("/orders/transitions", response_model=OrderTransitionResult)
+async def transition_orders(
+    transition: BulkOrderTransition,
+    _: dict = Depends(auth.require_roles(UserRole.ADMIN.value, UserRole.SUPPORT.value))
+):
+    """نقل حالة عدة طلبات دفعة واحدة مع إرجاع التعارضات"""
+    return await order_state.transition_orders(database.db, transition.order_ids, transition.status)
+
+@api_router.post("/orders/{order_id}/transition", response_model=Order)
+async def transition_order(
+    order_id: str,
+    transition: OrderTransition,
+    _: dict = Depends(auth.require_roles(UserRole.ADMIN.value, UserRole.SUPPORT.value))
+):
+    """نقل حالة طلب واحد وفق آلة الحالات"""
+    result = await order_state.transition_orders(database.db, [order_id], transition.status, transition.expected_version)
+    if result.conflicts:
+        status_code, detail = _TRANSITION_ERRORS[result.conflicts[0].reason]
+        raise HTTPException(status_code=status_code, detail=detail)
+    order = await database.db.orders.find_one({"id": order_codec.match_id(order_id)})
+    if not order:
+        order = await archive.find_archived_order(database.db, order_id)
+    return Order.from_storage(order)
+
+# حالات لا يتبعها أي انتقال، يُغلق البث عند الوصول إليها
+FINAL_ORDER_STATUSES = {OrderStatus.DELIVERED.value, OrderStatus.CANCELLED.value, OrderStatus.REFUNDED.value}
+
+@api_router.get("/orders/{order_id}/events")
+async def stream_order_status(order_id: str):
+    """بث تغييرات حالة الطلب عبر Server-Sent Events بدلاً من الاستطلاع المتكرر"""
+    fields = order_codec.projection(["status", "updated_at", "delivery_time_estimate"])
+    order = await database.db.orders.find_one({"id": order_codec.match_id(order_id)}, fields)
+    if not order:
+        # الطلبات المؤرشفة منتهية دائماً: تُرسل حالتها ويُغلق البث
+        order = await archive.find_archived_order(database.db, order_id, fields)
     if not order:
         raise HTTPException(status_code=404, detail="الطلب غير موجود")
-    return Order(**order)
+    order = order_codec.from_storage(order)
+
+    def status_message(current):
+        return sse_message({
+            "order_id": order_id,
+            "status": current["status"],
+            "updated_at": current.get("updated_at"),
+            "delivery_time_estimate": current.get("delivery_time_estimate"),
+        }, event="status")
+
+    async def event_stream():
+        current = order
+        if current["status"] in FINAL_ORDER_STATUSES:
+            yield status_message(current)
+            return
+
+        watcher = order_events.watcher
+        queue = watcher.subscribe(order["_id"], current["status"])
+        try:
+            # إعادة القراءة بعد الاشتراك: أي انتقال وقع قبل الاشتراك لم يصل إلى المراقب
+            latest = await database.db.orders.find_one({"_id": order["_id"]}, fields)
+            if not latest:
+                latest = await archive.find_archived_order(database.db, order_id, fields)
+            if latest:
+                current = order_codec.from_storage(latest)
+            status = current["status"]
+            yield status_message(current)
+            if status in FINAL_ORDER_STATUSES:
+                return
+
+            async for change in queue_events(queue):
+                if change is None:
+                    yield b": heartbeat\n\n"
+                    continue
+                if change["status"] == status:
+                    continue
+                status = change["status"]
+                yield sse_message({"order_id": order_id, **change}, event="status")
+                if status in FINAL_ORDER_STATUSES:
+                    return
+        finally:
+            watcher.unsubscribe(order["_id"], queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 # =====================================================
@@ -199,7 +306,7 @@ async def get_dashboard_metrics():
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     
     # طلبات اليوم
-    today_orders = await db.orders.count_documents({
+    today_orders = await database.db.orders.count_documents({
         "created_at": {"$gte": today}
     })
     
@@ -208,17 +315,17 @@ async def get_dashboard_metrics():
         {"$match": {"created_at": {"$gte": today}, "status": "completed"}},
         {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
     ]
-    today_revenue_result = await db.orders.aggregate(today_revenue_pipeline).to_list(1)
+    today_revenue_result = await database.db.orders.aggregate(today_revenue_pipeline).to_list(1)
     today_revenue = float(today_revenue_result[0]["total"]) if today_revenue_result else 0.0
     
     # إجمالي العملاء
-    total_customers = await db.users.count_documents({"role": "customer"})
+    total_customers = await database.db.users.count_documents({"role": "customer"})
     
     # الخدمات النشطة
-    active_services = await db.services.count_documents({"is_active": True})
+    active_services = await database.db.services.count_documents({"is_active": True})
     
     # الطلبات المعلقة
-    pending_orders = await db.orders.count_documents({"status": "pending"})
+    pending_orders = await database.db.orders.count_documents({"status": "pending"})
     
     return DashboardMetrics(
         total_orders_today=today_orders,
@@ -226,14 +333,84 @@ async def get_dashboard_metrics():
         total_customers=total_customers,
         active_services=active_services,
         pending_orders=pending_orders,
-        success_rate_today=95.0  # يمكن حسابها لاحقاً
+        success_rate_today=95.0,  # يمكن حسابها لاحقاً
+        top_selling_cards=recommendations.top_selling_cards()
     )
 
-# Include the router in the main app
-app.include_router(api_router)
+# Include the routers
+api_router.include_router(users.router)
+api_router.include_router(notifications.router)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def create_indexes(db) -> None:
+    await db.orders.create_index("id", unique=True)
+    await archive.ensure_indexes(db)
+    await users.ensure_indexes(db)
+    await notifications.ensure_indexes(db)
+    await recommendations.ensure_indexes(db)
+
+
+def warm_up(app: FastAPI) -> None:
+    """بناء مخطط OpenAPI وسياق التجزئة قبل أول طلب بدلاً من أثنائه"""
+    app.openapi()
+    auth.warm_up()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = database.connect()
+    await create_indexes(db)
+    await rate_limit.configure(db)
+    await order_numbers.configure(db)
+    await activity_log.start(db)
+    await notifications.start(db)
+    await order_events.start(db)
+    await archive.start(db)
+    await recommendations.start(db)
+    warm_up(app)
+    try:
+        yield
+    finally:
+        await recommendations.stop()
+        await archive.stop()
+        await order_events.stop()
+        await notifications.stop()
+        await activity_log.stop()
+        database.close()
+
+
+def create_app() -> FastAPI:
+    """إنشاء التطبيق؛ الاتصال بقاعدة البيانات يتم في دورة الحياة لا عند الاستيراد"""
+    app = FastAPI(
+        title="خدمات البطاقات الرقمية",
+        description="منصة شاملة لبيع وإدارة البطاقات الرقمية مسبقة الدفع",
+        version="1.0.0",
+        lifespan=lifespan,
+    )
+    app.include_router(api_router)
+    app.add_api_route("/", root, methods=["GET"])
+    app.add_middleware(rate_limit.RateLimitMiddleware)
+    app.add_middleware(activity_log.ActivityLogMiddleware)
+    # CORS في الخارج حتى تحمل ردود 429/503 ترويسات CORS ولا تستهلك طلبات preflight الحد
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Retry-After"],
+    )
+    return app
+
 
 # Simple root endpoint
-@app.get("/")
 async def root():
     return {
         "message": "مرحباً بكم في منصة البطاقات الرقمية",
@@ -242,21 +419,5 @@ async def root():
         "status": "active"
     }
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+app = create_app()
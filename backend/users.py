@@ -0,0 +1,118 @@
+"""
+نقاط نهاية المستخدمين
+User registration, login and profile endpoints
+"""
+
+import os
+from datetime import datetime
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends, HTTPException
+from pymongo.errors import DuplicateKeyError
+
+import auth
+from cache import TTLCache
+import database
+from models import TokenResponse, User, UserCreate, UserLogin, UserRole, UserUpdate
+
+
+PROFILE_CACHE_TTL = float(os.environ.get('USER_PROFILE_CACHE_TTL', '30'))
+PROFILE_CACHE_SIZE = int(os.environ.get('USER_PROFILE_CACHE_SIZE', '10000'))
+
+router = APIRouter(prefix="/users")
+
+# الملفات الشخصية حسب المعرف؛ تُحذف عند التحديث
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+
+_PROFILE_PROJECTION = {"_id": 0, "password_hash": 0}
+
+
+async def ensure_indexes(db) -> None:
+    """فهارس مجموعة المستخدمين"""
+    await db.users.create_index("email", unique=True)
+    await db.users.create_index("id", unique=True)
+    await db.users.create_index("role")
+
+
+async def get_user_profile(user_id: str) -> User:
+    """الملف الشخصي من الذاكرة المؤقتة أو من قاعدة البيانات"""
+    user = profile_cache.get(user_id)
+    if user is None:
+        doc = await database.db.users.find_one({"id": user_id}, _PROFILE_PROJECTION)
+        if not doc:
+            raise HTTPException(status_code=404, detail="المستخدم غير موجود")
+        user = User(**doc)
+        profile_cache.set(user_id, user)
+    return user
+
+
+@router.post("/register", response_model=User)
+async def register_user(user_data: UserCreate):
+    """تسجيل مستخدم جديد"""
+    fields = user_data.model_dump(exclude={"password"})
+    fields["email"] = fields["email"].lower()
+    user = User(**fields)
+
+    password_hash = await auth.hash_password(user_data.password)
+    try:
+        await database.db.users.insert_one({**user.model_dump(), "password_hash": password_hash})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="البريد الإلكتروني مسجل مسبقاً")
+    return user
+
+
+@router.post("/login", response_model=TokenResponse)
+async def login_user(credentials: UserLogin):
+    """تسجيل الدخول وإصدار رمز JWT"""
+    doc = await database.db.users.find_one({"email": credentials.email.lower()}, {"_id": 0})
+    valid, new_hash = await auth.verify_password(credentials.password, doc.get("password_hash") if doc else None)
+    if not valid or not doc.get("is_active", True):
+        raise HTTPException(status_code=401, detail="البريد الإلكتروني أو كلمة المرور غير صحيحة")
+
+    now = datetime.utcnow()
+    update: Dict[str, Any] = {"last_login": now}
+    if new_hash:
+        # إعادة التجزئة بعد تغيير إعدادات التجزئة
+        update["password_hash"] = new_hash
+    await database.db.users.update_one({"id": doc["id"]}, {"$set": update})
+
+    doc.pop("password_hash", None)
+    doc["last_login"] = now
+    user = User(**doc)
+    profile_cache.set(user.id, user)
+
+    return TokenResponse(
+        access_token=auth.create_access_token(user.id, user.role.value),
+        expires_in=auth.JWT_EXPIRE_MINUTES * 60,
+        user=user,
+    )
+
+
+@router.get("/me", response_model=User)
+async def get_my_profile(user_id: str = Depends(auth.get_current_user_id)):
+    """الملف الشخصي للمستخدم الحالي"""
+    return await get_user_profile(user_id)
+
+
+@router.put("/me", response_model=User)
+async def update_my_profile(
+    user_update: UserUpdate,
+    user_id: str = Depends(auth.get_current_user_id)
+):
+    """تحديث الملف الشخصي للمستخدم الحالي"""
+    changes = user_update.model_dump(exclude_unset=True)
+    if changes:
+        changes["updated_at"] = datetime.utcnow()
+        result = await database.db.users.update_one({"id": user_id}, {"$set": changes})
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="المستخدم غير موجود")
+        profile_cache.pop(user_id)
+    return await get_user_profile(user_id)
+
+
+@router.get("/{user_id}", response_model=User)
+async def get_user(user_id: str, payload: Dict[str, Any] = Depends(auth.get_token_payload)):
+    """الحصول على ملف مستخدم (للمستخدم نفسه أو للمدير)"""
+    if payload["sub"] != user_id and payload.get("role") != UserRole.ADMIN.value:
+        raise HTTPException(status_code=403, detail="غير مصرح")
+    return await get_user_profile(user_id)
@@ -0,0 +1,48 @@
+"""
+إعداد الاختبارات
+Shared fixtures: backend modules on sys.path and an in-memory MongoDB
+"""
+
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("JWT_SECRET", "test-secret-key-with-at-least-32-bytes")
+# mongomock لا يدعم المجموعات الزمنية ولا change streams
+os.environ.setdefault("ACTIVITY_LOG_STORAGE", "ttl")
+os.environ.setdefault("ORDER_EVENTS_MODE", "polling")
+
+
+@pytest.fixture
+def db():
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()["test_database"]
+
+
+@pytest.fixture
+def make_order():
+    """بناء طلب صالح (model_dump) بحقول افتراضية تُستبدل بما يُمرر"""
+    from models import Order, OrderStatus
+
+    def build(status: OrderStatus = OrderStatus.PENDING, **fields) -> dict:
+        defaults = dict(
+            order_number=f"ORD-{uuid.uuid4().hex[:12].upper()}",
+            user_id=str(uuid.uuid4()),
+            customer_email="user@example.com",
+            customer_name="أحمد",
+            items=[],
+            subtotal=10.0,
+            total_amount=10.0,
+        )
+        return Order(**{**defaults, "status": status, **fields}).model_dump()
+
+    return build
@@ -0,0 +1,159 @@
+"""
+أرشفة الطلبات
+Moving terminal orders to monthly collections, reruns after a crash and reads
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import archive
+import order_codec
+import order_state
+from models import OrderStatus
+
+
+CUTOFF = datetime(2024, 1, 1)
+JANUARY = datetime(2023, 1, 15)
+MARCH = datetime(2023, 3, 2)
+
+
+class _Wrapped:
+    """قاعدة بيانات تمرر كل شيء عدا مجموعة orders المستبدلة"""
+
+    def __init__(self, db, orders):
+        self._db = db
+        self.orders = orders
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def __getitem__(self, name):
+        return self.orders if name == "orders" else self._db[name]
+
+
+class _Orders:
+    def __init__(self, collection, before_delete):
+        self._collection = collection
+        self._before_delete = before_delete
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, operations, **kwargs):
+        await self._before_delete()
+        return await self._collection.bulk_write(operations, **kwargs)
+
+
+async def _archived(db, order_id, created_at):
+    return await db[archive.archive_name(created_at)].find_one({"id": order_codec.match_id(order_id)})
+
+
+def test_archive_batch_moves_old_terminal_orders_by_month(db, make_order):
+    orders = [
+        make_order(OrderStatus.DELIVERED, created_at=JANUARY),
+        make_order(OrderStatus.REFUNDED, created_at=MARCH),
+        make_order(OrderStatus.COMPLETED, created_at=JANUARY),
+        make_order(OrderStatus.CANCELLED, created_at=datetime(2024, 6, 1)),
+    ]
+
+    async def run():
+        await db.orders.insert_many([order_codec.encode_order(order) for order in orders])
+        moved = await archive.archive_batch(db, CUTOFF)
+        hot = {order_codec.decode_uuid(doc["id"]) async for doc in db.orders.find()}
+        found = [await archive.find_archived_order(db, order["id"]) for order in orders]
+        return moved, hot, found, await archive.archive_collections(db)
+
+    moved, hot, found, collections = asyncio.run(run())
+    assert moved == 2
+    assert hot == {orders[2]["id"], orders[3]["id"]}
+    assert [order_codec.from_storage(doc)["status"] for doc in found[:2]] == ["delivered", "refunded"]
+    assert found[2:] == [None, None]
+    assert collections == ["orders_archive_202301", "orders_archive_202303"]
+
+
+def test_archive_orders_runs_batches_until_done(db, make_order):
+    async def run():
+        await db.orders.insert_many([make_order(OrderStatus.DELIVERED, created_at=JANUARY) for _ in range(5)])
+        moved = await archive.archive_orders(db, older_than_days=30, batch_size=2)
+        return moved, await db.orders.count_documents({}), await db[archive.INDEX_COLLECTION].count_documents({})
+
+    assert asyncio.run(run()) == (5, 0, 5)
+
+
+def test_rerun_after_crash_archives_latest_version(db, make_order):
+    order = make_order(OrderStatus.DELIVERED, created_at=JANUARY)
+
+    async def crash():
+        raise RuntimeError("توقف بعد النسخ وقبل الحذف")
+
+    async def run():
+        await db.orders.insert_one(dict(order))
+        with pytest.raises(RuntimeError):
+            await archive.archive_batch(_Wrapped(db, _Orders(db.orders, crash)), CUTOFF)
+        assert await _archived(db, order["id"], JANUARY) is not None
+
+        # الطلب ما زال في المجموعة الساخنة فيُسترد قبل إعادة التشغيل
+        result = await order_state.transition_orders(db, [order["id"]], OrderStatus.REFUNDED)
+        assert result.updated == [order["id"]]
+
+        moved = await archive.archive_batch(db, CUTOFF)
+        return moved, await db.orders.count_documents({}), await _archived(db, order["id"], JANUARY)
+
+    moved, hot, archived = asyncio.run(run())
+    assert (moved, hot) == (1, 0)
+    assert (archived["status"], archived["version"]) == ("refunded", 1)
+
+
+def test_order_changed_during_batch_stays_hot_without_archive_copy(db, make_order):
+    order = make_order(OrderStatus.DELIVERED, created_at=JANUARY)
+
+    async def refund():
+        await order_state.transition_orders(db, [order["id"]], OrderStatus.REFUNDED)
+
+    async def run():
+        await db.orders.insert_one(dict(order))
+        moved = await archive.archive_batch(_Wrapped(db, _Orders(db.orders, refund)), CUTOFF)
+        hot = await db.orders.find_one({"id": order["id"]})
+        return moved, hot, await _archived(db, order["id"], JANUARY), await archive.find_archived_order(db, order["id"])
+
+    moved, hot, archived, found = asyncio.run(run())
+    assert moved == 0
+    assert hot["status"] == "refunded"
+    assert archived is None and found is None
+
+
+def test_ensure_indexes_covers_existing_archive_collections(db):
+    async def run():
+        await db["orders_archive_202301"].insert_one({"id": "x", "created_at": JANUARY})
+        await archive.ensure_indexes(db)
+        return await db["orders_archive_202301"].index_information()
+
+    indexes = {tuple(index["key"]) for index in asyncio.run(run()).values()}
+    assert (("id", 1),) in indexes
+    assert (("status", 1), ("created_at", 1)) in indexes
+    assert (("user_id", 1), ("created_at", -1)) in indexes
+
+
+def test_iter_orders_merges_archive_and_hot_by_created_at(db, make_order):
+    created = [datetime(2023, 1, 10), JANUARY, datetime(2023, 2, 1), MARCH, datetime(2023, 4, 1)]
+    statuses = [OrderStatus.COMPLETED, OrderStatus.DELIVERED, OrderStatus.COMPLETED, OrderStatus.CANCELLED,
+                OrderStatus.DELIVERED]
+
+    async def run():
+        await db.orders.insert_many([make_order(status, created_at=at) for status, at in zip(statuses, created)])
+        await archive.archive_batch(db, CUTOFF)
+        hot = await db.orders.count_documents({})
+        seen = [doc["created_at"] async for doc in archive.iter_orders(db, {}, projection={"status": 1})]
+        partial = []
+        async for doc in archive.iter_orders(db, {}):
+            partial.append(doc["created_at"])
+            if len(partial) == 2:
+                break
+        return hot, seen, partial
+
+    hot, seen, partial = asyncio.run(run())
+    assert hot == 2
+    assert seen == created
+    assert partial == created[:2]
@@ -0,0 +1,170 @@
+"""
+كاتب الدفعات
+Overflow policies, size/time flushes, flush on stop and per-batch error handling
+"""
+
+import asyncio
+
+import pytest
+
+from batch_writer import BatchWriter, OverflowPolicy
+
+
+class _FlakyCollection:
+    """مجموعة تفشل أول عملية إدخال فيها بخطأ غير متعلق بـ MongoDB"""
+
+    def __init__(self, collection, failures: int = 1):
+        self._collection = collection
+        self.failures = failures
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def insert_many(self, docs, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("تعذر ترميز المستند")
+        return await self._collection.insert_many(docs, **kwargs)
+
+
+def _queued(writer: BatchWriter) -> list:
+    return [doc["n"] for doc in writer._queue._queue]
+
+
+def test_drop_newest_rejects_new_documents_when_full(db):
+    writer = BatchWriter(db.events, max_queue_size=2, overflow_policy=OverflowPolicy.DROP_NEWEST)
+    assert [writer.submit({"n": n}) for n in range(3)] == [True, True, False]
+    assert _queued(writer) == [0, 1]
+    assert writer.dropped == 1
+
+
+def test_drop_oldest_makes_room_for_new_documents(db):
+    writer = BatchWriter(db.events, max_queue_size=2, overflow_policy=OverflowPolicy.DROP_OLDEST)
+    assert [writer.submit({"n": n}) for n in range(3)] == [True, True, False]
+    assert _queued(writer) == [1, 2]
+    assert writer.dropped == 1
+
+
+def test_block_waits_for_space(db):
+    async def run():
+        writer = BatchWriter(db.events, max_queue_size=1, overflow_policy=OverflowPolicy.BLOCK)
+        await writer.put({"n": 0})
+        blocked = asyncio.ensure_future(writer.put({"n": 1}))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        writer._queue.get_nowait()
+        assert await asyncio.wait_for(blocked, 1) is True
+        return writer
+
+    writer = asyncio.run(run())
+    assert _queued(writer) == [1]
+    assert writer.dropped == 0
+
+
+def test_full_batch_is_flushed_before_interval(db):
+    async def run():
+        writer = BatchWriter(db.events, batch_size=3, flush_interval=60)
+        writer.start()
+        for n in range(3):
+            await writer.put({"n": n})
+        await asyncio.sleep(0.05)
+        written = await db.events.count_documents({})
+        await writer.stop()
+        return written
+
+    assert asyncio.run(run()) == 3
+
+
+def test_partial_batch_is_flushed_after_interval(db):
+    async def run():
+        writer = BatchWriter(db.events, batch_size=100, flush_interval=0.05)
+        writer.start()
+        await writer.put({"n": 0})
+        before = await db.events.count_documents({})
+        await asyncio.sleep(0.15)
+        after = await db.events.count_documents({})
+        await writer.stop()
+        return before, after
+
+    assert asyncio.run(run()) == (0, 1)
+
+
+def test_stop_flushes_everything_queued(db):
+    flushed = []
+
+    async def on_flush(batch):
+        flushed.append(len(batch))
+
+    async def run():
+        writer = BatchWriter(db.events, batch_size=2, flush_interval=60, on_flush=on_flush)
+        for n in range(5):
+            writer.submit({"n": n})
+        await writer.stop()
+        return writer, sorted([doc["n"] async for doc in db.events.find()])
+
+    writer, stored = asyncio.run(run())
+    assert stored == [0, 1, 2, 3, 4]
+    assert writer.written == 5 and writer.pending == 0
+    assert flushed == [2, 2, 1]
+
+
+def test_failed_batch_is_dropped_and_flusher_keeps_running(db):
+    async def run():
+        writer = BatchWriter(_FlakyCollection(db.events), batch_size=2, flush_interval=0.01)
+        writer.start()
+        await writer.put({"n": 0})
+        await writer.put({"n": 1})
+        await asyncio.sleep(0.05)
+        await writer.put({"n": 2})
+        await asyncio.sleep(0.05)
+        alive = not writer._task.done()
+        await writer.stop()
+        return writer, alive, [doc["n"] async for doc in db.events.find()]
+
+    writer, alive, stored = asyncio.run(run())
+    assert alive
+    assert stored == [2]
+    assert (writer.dropped, writer.written) == (2, 1)
+
+
+def test_duplicate_keys_drop_only_failed_documents(db):
+    flushed = []
+
+    async def on_flush(batch):
+        flushed.extend(doc["_id"] for doc in batch)
+
+    async def run():
+        await db.events.insert_one({"_id": 1})
+        writer = BatchWriter(db.events, on_flush=on_flush)
+        for _id in (0, 1, 2):
+            writer.submit({"_id": _id})
+        await writer.stop()
+        return writer
+
+    writer = asyncio.run(run())
+    assert (writer.dropped, writer.written) == (1, 2)
+    assert flushed == [0, 2]
+
+
+def test_on_flush_errors_do_not_stop_the_writer(db):
+    async def on_flush(batch):
+        raise RuntimeError("فشل تحديث العدادات")
+
+    async def run():
+        writer = BatchWriter(db.events, batch_size=1, flush_interval=0.01, on_flush=on_flush)
+        writer.start()
+        for n in range(2):
+            await writer.put({"n": n})
+            await asyncio.sleep(0.03)
+        alive = not writer._task.done()
+        await writer.stop()
+        return writer, alive
+
+    writer, alive = asyncio.run(run())
+    assert alive
+    assert writer.written == 2
+
+
+@pytest.mark.parametrize("policy", list(OverflowPolicy))
+def test_policy_accepts_string_values(db, policy):
+    assert BatchWriter(db.events, overflow_policy=policy.value).overflow_policy is policy
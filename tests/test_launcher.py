@@ -0,0 +1,49 @@
+"""
+تشغيل الخادم بعدة عمليات
+Launcher argument checks and per-worker pool sizing
+"""
+
+import pytest
+
+import launcher
+
+
+@pytest.fixture
+def supervisors(monkeypatch):
+    started = []
+
+    class Supervisor:
+        def __init__(self, options, workers):
+            started.append(workers)
+
+        def run(self):
+            pass
+
+    monkeypatch.setattr(launcher, "Supervisor", Supervisor)
+    return started
+
+
+def test_multiple_workers_require_jwt_secret(monkeypatch, supervisors, capsys):
+    monkeypatch.delenv("JWT_SECRET", raising=False)
+    with pytest.raises(SystemExit) as exit_info:
+        launcher.main(["--workers", "2"])
+    assert exit_info.value.code == 2
+    assert "JWT_SECRET" in capsys.readouterr().err
+    assert supervisors == []
+
+
+def test_single_worker_runs_without_jwt_secret(monkeypatch, supervisors):
+    monkeypatch.delenv("JWT_SECRET", raising=False)
+    launcher.main(["--workers", "1"])
+    assert supervisors == [1]
+
+
+def test_multiple_workers_start_with_jwt_secret(monkeypatch, supervisors):
+    monkeypatch.setenv("JWT_SECRET", "test-secret-key-with-at-least-32-bytes")
+    launcher.main(["--workers", "4"])
+    assert supervisors == [4]
+
+
+def test_pool_size_leaves_room_for_rolling_restart():
+    assert launcher.pool_size_per_worker(4, max_connections=500) == 100
+    assert launcher.pool_size_per_worker(1000, max_connections=500) == 1
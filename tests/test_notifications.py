@@ -0,0 +1,167 @@
+"""
+الإشعارات
+Incremental unread counters, read decrements and counter resync
+"""
+
+import asyncio
+
+import pytest
+
+import database
+import notifications
+from models import Notification, NotificationBase
+
+
+USER = "user-1"
+
+
+@pytest.fixture(autouse=True)
+def notifications_db(db, monkeypatch):
+    monkeypatch.setattr(database, "db", db)
+    notifications.unread_cache.clear()
+    yield db
+    notifications.unread_cache.clear()
+
+
+def _content(user_id: str = USER) -> NotificationBase:
+    return NotificationBase(user_id=user_id, title="t", title_ar="ع", message="m", message_ar="ر", type="system")
+
+
+def _notification(user_id: str = USER) -> dict:
+    return Notification(**_content(user_id).model_dump()).model_dump()
+
+
+async def _flush(db, *docs) -> None:
+    """محاكاة دفعة كتبها BatchWriter ثم معالج ما بعد التفريغ"""
+    await db.notifications.insert_many(list(docs))
+    await notifications._after_flush(list(docs))
+
+
+async def _counter(db, user_id: str = USER):
+    return await db.notification_counters.find_one({"_id": user_id})
+
+
+def test_flush_increments_counters_per_user(db):
+    async def run():
+        await _flush(db, _notification(), _notification(), _notification("user-2"))
+        return await _counter(db), await _counter(db, "user-2")
+
+    first, second = asyncio.run(run())
+    assert first["unread"] == 2 and second["unread"] == 1
+
+
+def test_flush_updates_cached_count_and_publishes(db):
+    async def run():
+        await _flush(db, _notification())
+        assert await notifications.get_unread_count(USER) == 1
+        queue = notifications.hub.subscribe(USER)
+        try:
+            await _flush(db, _notification())
+            events = [queue.get_nowait() for _ in range(queue.qsize())]
+        finally:
+            notifications.hub.unsubscribe(USER, queue)
+        return events, await notifications.get_unread_count(USER)
+
+    events, count = asyncio.run(run())
+    assert count == 2
+    assert events[0] == ("unread_count", {"unread_count": 2})
+    assert events[1][0] == "notification"
+
+
+def test_read_and_read_all_decrement_counter(db):
+    async def run():
+        docs = [_notification() for _ in range(3)]
+        await _flush(db, *docs)
+        assert await notifications.get_unread_count(USER) == 3
+
+        await notifications.mark_notification_read(docs[0]["id"], user_id=USER)
+        # قراءة الإشعار نفسه مرة ثانية لا تنقص العداد
+        await notifications.mark_notification_read(docs[0]["id"], user_id=USER)
+        after_one = await notifications.get_unread_count(USER), (await _counter(db))["unread"]
+
+        result = await notifications.mark_all_notifications_read(user_id=USER)
+        after_all = await notifications.get_unread_count(USER), (await _counter(db))["unread"]
+        return after_one, result, after_all
+
+    after_one, result, after_all = asyncio.run(run())
+    assert after_one == (2, 2)
+    assert result == {"updated": 2}
+    assert after_all == (0, 0)
+
+
+def test_missing_counter_is_recomputed(db):
+    async def run():
+        await db.notifications.insert_many([_notification(), _notification(), {**_notification(), "is_read": True}])
+        return await notifications.get_unread_count(USER), await _counter(db)
+
+    count, counter = asyncio.run(run())
+    assert count == 2
+    assert counter["unread"] == 2
+
+
+def test_negative_counter_is_recomputed(db):
+    async def run():
+        await db.notifications.insert_one(_notification())
+        await db.notification_counters.insert_one({"_id": USER, "unread": -3})
+        return await notifications.get_unread_count(USER), await _counter(db)
+
+    count, counter = asyncio.run(run())
+    assert count == 1
+    assert counter["unread"] == 1
+
+
+class _FailingCounters:
+    """مجموعة عدادات يفشل فيها bulk_write"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, operations, **kwargs):
+        raise RuntimeError("انقطع الاتصال")
+
+
+class _FailingCountersDb:
+    def __init__(self, db):
+        self._db = db
+        self.notification_counters = _FailingCounters(db.notification_counters)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+def test_failed_counter_update_is_resynced_on_next_read(db, monkeypatch):
+    async def run():
+        await _flush(db, _notification())
+        assert await notifications.get_unread_count(USER) == 1
+
+        monkeypatch.setattr(database, "db", _FailingCountersDb(db))
+        await _flush(db, _notification(), _notification())
+        stale = await _counter(db)
+
+        monkeypatch.setattr(database, "db", db)
+        # دفعة ناجحة بعد الفشل لا تزيل علامة إعادة المزامنة
+        await _flush(db, _notification())
+        return stale, await notifications.get_unread_count(USER), await _counter(db)
+
+    stale, count, counter = asyncio.run(run())
+    assert stale == {"_id": USER, "unread": 1, "stale": True}
+    assert count == 4
+    assert counter == {"_id": USER, "unread": 4}
+
+
+def test_writer_flushes_and_counts_on_stop(db):
+    async def run():
+        await notifications.start(db)
+        try:
+            for _ in range(3):
+                await notifications.notify(_content())
+        finally:
+            await notifications.stop()
+        return await db.notifications.count_documents({"user_id": USER}), await _counter(db)
+
+    stored, counter = asyncio.run(run())
+    assert stored == 3
+    assert counter["unread"] == 3
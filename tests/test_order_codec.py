@@ -0,0 +1,204 @@
+"""
+ترميز الطلبات المضغوط
+Compact order codec round-trips, dual-format id matching and migration
+"""
+
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from bson.binary import Binary
+
+import migrate_orders
+import order_codec
+from models import Order
+
+
+ORDER_ID = str(uuid.uuid4())
+USER_ID = str(uuid.uuid4())
+ITEM_ID = str(uuid.uuid4())
+CARD_ID = str(uuid.uuid4())
+
+
+_FIELDS = dict(
+    id=ORDER_ID,
+    order_number="ORD-000000000001",
+    user_id=USER_ID,
+    items=[{"id": ITEM_ID, "card_product_id": CARD_ID, "quantity": 2, "unit_price": 9.99}],
+    subtotal=19.98,
+    total_amount=19.98,
+    created_at=datetime(2024, 12, 6, 17, 50, 30),
+)
+
+
+@pytest.fixture
+def sample_order(make_order):
+    """طلب ثابت المعرفات ببند واحد"""
+    return lambda **overrides: make_order(**{**_FIELDS, **overrides})
+
+
+def test_round_trip_restores_full_order(sample_order):
+    order = sample_order(notes="ملاحظة", discount_amount=1.5, currency="EUR", version=3)
+    encoded = order_codec.encode_order(order)
+    assert Order(**order_codec.decode_order(encoded)).model_dump() == order
+
+
+def test_encoded_order_uses_aliases_binary_uuids_and_omits_defaults(sample_order):
+    encoded = order_codec.encode_order(sample_order())
+
+    assert encoded[order_codec.FORMAT_FIELD] == order_codec.FORMAT_VERSION
+    assert encoded["ce"] == "user@example.com"
+    assert "customer_email" not in encoded
+    # الحقول المستخدمة في الاستعلامات تبقى بأسمائها
+    assert {"id", "order_number", "user_id", "status", "created_at", "total_amount"} <= set(encoded)
+
+    assert isinstance(encoded["id"], Binary) and encoded["id"].subtype == 4
+    assert isinstance(encoded["user_id"], Binary)
+    item = encoded["it"][0]
+    assert isinstance(item["i"], Binary) and isinstance(item["p"], Binary)
+
+    # القيم الافتراضية و None لا تُخزن
+    for omitted in ("da", "cu", "n", "version", "updated_at", "completed_at", "de"):
+        assert omitted not in encoded
+    assert "d" not in item and "c" not in item
+
+
+def test_round_trip_restores_defaults_and_none_fields(sample_order):
+    order = sample_order()
+    decoded = order_codec.decode_order(order_codec.encode_order(order))
+    assert decoded["discount_amount"] == 0.0
+    assert decoded["currency"] == "USD"
+    assert decoded["version"] == 0
+    assert decoded["items"][0]["card_codes"] == []
+    assert decoded["items"][0]["discount_applied"] == 0.0
+    assert Order(**decoded).model_dump() == order
+
+
+def test_default_with_different_type_is_kept(sample_order):
+    encoded = order_codec.encode_order({**sample_order(), "discount_amount": 0})
+    assert encoded["da"] == 0
+
+
+def test_legacy_document_is_returned_unchanged(sample_order):
+    legacy = {"_id": "x", **sample_order(), "order_number": "ORD-20241206175030-SAMPLE01"}
+    legacy.pop("version")
+    assert order_codec.decode_order(legacy) is legacy
+    assert Order.from_storage(legacy).version == 0
+
+
+def test_non_uuid_ids_are_stored_as_strings(sample_order):
+    order = sample_order()
+    order["items"][0]["id"] = "item-1"
+    encoded = order_codec.encode_order(order)
+    assert encoded["it"][0]["i"] == "item-1"
+    assert order_codec.decode_order(encoded)["items"][0]["id"] == "item-1"
+
+
+def test_from_storage_accepts_both_formats(sample_order):
+    order = sample_order()
+    assert order_codec.from_storage(order) == order
+    assert Order(**order_codec.from_storage(order_codec.encode_order(order))).model_dump() == order
+
+
+def test_match_id_matches_both_formats():
+    assert order_codec.match_id("not-a-uuid") == "not-a-uuid"
+    match = order_codec.match_id(ORDER_ID)
+    assert match["$in"][0] == ORDER_ID
+    assert order_codec.decode_uuid(match["$in"][1]) == ORDER_ID
+
+
+def test_match_ids_matches_both_formats():
+    match = order_codec.match_ids([ORDER_ID, "item-1"])
+    assert match["$in"][:2] == [ORDER_ID, order_codec.encode_uuid(ORDER_ID)]
+    assert match["$in"][2:] == ["item-1"]
+
+
+def test_match_id_finds_legacy_and_compact_documents(db, sample_order):
+    legacy_id, compact_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+    async def run():
+        await db.orders.insert_one(sample_order(id=legacy_id))
+        await db.orders.insert_one(order_codec.encode_order(sample_order(id=compact_id)))
+        found = []
+        for order_id in (legacy_id, compact_id):
+            doc = await db.orders.find_one({"id": order_codec.match_id(order_id)})
+            found.append(order_codec.from_storage(doc)["id"])
+        both = await db.orders.count_documents({"id": order_codec.match_ids([legacy_id, compact_id])})
+        return found, both
+
+    found, both = asyncio.run(run())
+    assert found == [legacy_id, compact_id]
+    assert both == 2
+
+
+def test_projection_includes_aliases():
+    projection = order_codec.projection(["status", "customer_email", "items"])
+    assert projection == {"_f": 1, "status": 1, "customer_email": 1, "ce": 1, "items": 1, "it": 1}
+
+
+def test_migrate_forward_then_reverse(db, sample_order):
+    orders = [sample_order(id=str(uuid.uuid4()), order_number=f"ORD-{i:012d}") for i in range(5)]
+
+    async def run():
+        await db.orders.insert_many([dict(order) for order in orders])
+
+        report = await migrate_orders.migrate(db.orders, batch_size=2, reverse=False, report_only=False, limit=0)
+        assert report.count == 5
+        assert report.bytes_after < report.bytes_before
+        compact = await db.orders.count_documents({order_codec.FORMAT_FIELD: order_codec.FORMAT_VERSION})
+        # تشغيل ثان لا يجد طلبات بالصيغة الكاملة
+        again = await migrate_orders.migrate(db.orders, batch_size=2, reverse=False, report_only=False, limit=0)
+
+        migrated = {doc["id"]: doc async for doc in db.orders.find({}, {"_id": 0})}
+        await migrate_orders.migrate(db.orders, batch_size=2, reverse=True, report_only=False, limit=0)
+        restored = [Order(**doc).model_dump()
+                    async for doc in db.orders.find({}, {"_id": 0}).sort("order_number", 1)]
+        return compact, again.count, migrated, restored
+
+    compact, again, migrated, restored = asyncio.run(run())
+    assert compact == 5
+    assert again == 0
+    assert {order_codec.decode_uuid(order_id) for order_id in migrated} == {order["id"] for order in orders}
+    assert restored == orders
+
+
+def test_migrate_report_only_and_limit_leave_documents_unchanged(db, sample_order):
+    async def run():
+        await db.orders.insert_many([sample_order(id=str(uuid.uuid4())) for _ in range(3)])
+        report = await migrate_orders.migrate(db.orders, batch_size=10, reverse=False, report_only=True, limit=2)
+        return report, await db.orders.count_documents({order_codec.FORMAT_FIELD: {"$exists": True}})
+
+    report, compact = asyncio.run(run())
+    assert report.count == 2
+    assert compact == 0
+
+
+class _ConcurrentUpdate:
+    """مجموعة تُعدَّل فيها الطلبات بين قراءة الدفعة وكتابتها"""
+
+    def __init__(self, collection, order_id):
+        self._collection = collection
+        self._order_id = order_id
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, operations, **kwargs):
+        await self._collection.update_one({"id": self._order_id}, {"$set": {"status": "processing"}})
+        return await self._collection.bulk_write(operations, **kwargs)
+
+
+def test_migrate_skips_orders_changed_concurrently(db, capsys, sample_order):
+    order = sample_order()
+
+    async def run():
+        await db.orders.insert_one(dict(order))
+        await migrate_orders.migrate(_ConcurrentUpdate(db.orders, order["id"]), batch_size=10,
+                                     reverse=False, report_only=False, limit=0)
+        return await db.orders.find_one({"id": order["id"]})
+
+    doc = asyncio.run(run())
+    assert order_codec.FORMAT_FIELD not in doc
+    assert doc["status"] == "processing"
+    assert "تم تخطي 1" in capsys.readouterr().out
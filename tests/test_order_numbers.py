@@ -0,0 +1,88 @@
+"""
+أرقام الطلبات
+Block-reserved order numbers: uniqueness across allocators, rollover and formatting
+"""
+
+import asyncio
+
+import order_numbers
+from order_numbers import OrderNumberAllocator, format_order_number
+
+
+def test_concurrent_allocators_sharing_a_counter_never_collide(db):
+    async def run():
+        allocators = [OrderNumberAllocator(db.counters, block_size=7) for _ in range(2)]
+        calls = [allocator for allocator in allocators for _ in range(250)]
+        values = await asyncio.gather(*(allocator.next_value() for allocator in calls))
+        return calls, values, await db.counters.find_one({"_id": order_numbers.COUNTER_ID})
+
+    calls, values, counter = asyncio.run(run())
+    assert len(set(values)) == len(values) == 500
+    # داخل كل عملية الأرقام متزايدة بترتيب الطلب
+    for allocator in set(calls):
+        own = [value for owner, value in zip(calls, values) if owner is allocator]
+        assert own == sorted(own)
+    assert counter["value"] % 7 == 0 and counter["value"] >= max(values)
+
+
+def test_block_rollover_reserves_next_range(db):
+    async def run():
+        first = OrderNumberAllocator(db.counters, block_size=3)
+        second = OrderNumberAllocator(db.counters, block_size=3)
+        values = [await first.next_value() for _ in range(3)]
+        values.append(await second.next_value())
+        values.append(await first.next_value())
+        return values, await db.counters.find_one({"_id": order_numbers.COUNTER_ID})
+
+    values, counter = asyncio.run(run())
+    # first: 1-3 ثم 7-9، second: 4-6
+    assert values == [1, 2, 3, 4, 7]
+    assert counter["value"] == 9
+
+
+def test_block_is_reserved_once_per_block_size(db):
+    async def run():
+        allocator = OrderNumberAllocator(db.counters, block_size=5)
+        reserve = allocator._reserve
+        calls = []
+
+        async def counted():
+            calls.append(1)
+            await reserve()
+
+        allocator._reserve = counted
+        values = await asyncio.gather(*(allocator.next_value() for _ in range(12)))
+        return values, len(calls)
+
+    values, reservations = asyncio.run(run())
+    assert sorted(values) == list(range(1, 13))
+    assert reservations == 3
+
+
+def test_counters_are_independent(db):
+    async def run():
+        orders = OrderNumberAllocator(db.counters, block_size=2)
+        other = OrderNumberAllocator(db.counters, block_size=2, counter_id="other")
+        return [await orders.next_value(), await other.next_value(), await orders.next_value()]
+
+    assert asyncio.run(run()) == [1, 1, 2]
+
+
+def test_format_is_zero_padded_and_sorts_numerically():
+    values = [1, 9, 10, 99, 100, 123456789012]
+    numbers = [format_order_number(value) for value in values]
+    assert numbers[0] == "ORD-000000000001"
+    assert all(len(number) == len(order_numbers.PREFIX) + order_numbers.WIDTH for number in numbers)
+    assert sorted(numbers) == numbers
+
+
+def test_configure_creates_unique_index_and_allocator(db, monkeypatch):
+    monkeypatch.setattr(order_numbers, "allocator", None)
+
+    async def run():
+        await order_numbers.configure(db)
+        return await db.orders.index_information(), await order_numbers.allocator.next()
+
+    indexes, number = asyncio.run(run())
+    assert any(index["key"] == [("order_number", 1)] and index.get("unique") for index in indexes.values())
+    assert number == "ORD-000000000001"
@@ -0,0 +1,202 @@
+"""
+آلة حالات الطلبات
+Allowed transitions, optimistic concurrency, bulk conflicts and archived orders
+"""
+
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import archive
+import database
+import notifications
+import order_codec
+import order_state
+import server
+from models import OrderStatus, OrderTransition
+
+
+async def _insert(db, *orders, compact=False) -> list:
+    await db.orders.insert_many([order_codec.encode_order(o) if compact else dict(o) for o in orders])
+    return [order["id"] for order in orders]
+
+
+async def _state(db, order_id, collection="orders"):
+    doc = await db[collection].find_one({"id": order_codec.match_id(order_id)})
+    return doc["status"], doc.get("version")
+
+
+@pytest.mark.parametrize("current, target, allowed", [
+    ("pending", "processing", True),
+    ("pending", "cancelled", True),
+    ("pending", "completed", False),
+    ("processing", "completed", True),
+    ("completed", "delivered", True),
+    ("completed", "refunded", True),
+    ("delivered", "refunded", True),
+    ("delivered", "pending", False),
+    ("cancelled", "processing", False),
+    ("refunded", "delivered", False),
+])
+def test_can_transition(current, target, allowed):
+    assert order_state.can_transition(current, target) is allowed
+
+
+def test_every_status_has_transition_rules():
+    assert set(order_state.ALLOWED_TRANSITIONS) == set(OrderStatus)
+
+
+def test_version_filter_matches_missing_field_for_version_zero(db):
+    async def run():
+        await db.orders.insert_many([{"_id": 1}, {"_id": 2, "version": 0}, {"_id": 3, "version": 1}])
+        zero = [doc["_id"] async for doc in db.orders.find({"version": order_state.version_filter(0)})]
+        one = [doc["_id"] async for doc in db.orders.find({"version": order_state.version_filter(1)})]
+        return zero, one
+
+    assert asyncio.run(run()) == ([1, 2], [3])
+
+
+def test_single_transition_bumps_version_and_sets_timestamps(db, monkeypatch, make_order):
+    notified = []
+
+    async def notify_order_completed(order):
+        notified.append(order.id)
+
+    monkeypatch.setattr(notifications, "notify_order_completed", notify_order_completed)
+
+    async def run():
+        [order_id] = await _insert(db, make_order(OrderStatus.PROCESSING), compact=True)
+        result = await order_state.transition_orders(db, [order_id], OrderStatus.COMPLETED, expected_version=0)
+        doc = order_codec.from_storage(await db.orders.find_one({"id": order_codec.match_id(order_id)}))
+        return order_id, result, doc
+
+    order_id, result, doc = asyncio.run(run())
+    assert result.updated == [order_id] and result.conflicts == []
+    assert doc["status"] == "completed"
+    assert doc["version"] == 1
+    assert doc["updated_at"] is not None and doc["completed_at"] is not None
+    assert notified == [order_id]
+
+
+def test_bulk_transition_reports_mixed_conflicts(db, make_order):
+    async def run():
+        pending, processing, cancelled = await _insert(
+            db, make_order(), make_order(OrderStatus.PROCESSING), make_order(OrderStatus.CANCELLED)
+        )
+        missing = str(uuid.uuid4())
+        ids = [pending, processing, cancelled, missing, pending]
+        result = await order_state.transition_orders(db, ids, OrderStatus.CANCELLED)
+        return (pending, processing, cancelled, missing), result, await _state(db, cancelled)
+
+    (pending, processing, cancelled, missing), result, cancelled_state = asyncio.run(run())
+    assert result.updated == [pending, processing]
+    assert [(c.order_id, c.reason) for c in result.conflicts] == [
+        (cancelled, "invalid_transition"), (missing, "not_found"),
+    ]
+    assert result.conflicts[0].status == OrderStatus.CANCELLED
+    assert cancelled_state == ("cancelled", 0)
+
+
+def test_bulk_transition_runs_in_batches(db, monkeypatch, make_order):
+    monkeypatch.setattr(order_state, "TRANSITION_BATCH_SIZE", 2)
+
+    async def run():
+        ids = await _insert(db, *[make_order() for _ in range(5)])
+        result = await order_state.transition_orders(db, ids, OrderStatus.PROCESSING)
+        return ids, result, await db.orders.count_documents({"status": "processing", "version": 1})
+
+    ids, result, moved = asyncio.run(run())
+    assert sorted(result.updated) == sorted(ids)
+    assert moved == 5
+
+
+def test_expected_version_mismatch_leaves_order_unchanged(db, make_order):
+    async def run():
+        [order_id] = await _insert(db, make_order(version=2))
+        result = await order_state.transition_orders(db, [order_id], OrderStatus.PROCESSING, expected_version=1)
+        return result, await _state(db, order_id)
+
+    result, state = asyncio.run(run())
+    assert result.updated == []
+    assert [(c.reason, c.version) for c in result.conflicts] == [("version_mismatch", 2)]
+    assert state == ("pending", 2)
+
+
+def test_concurrent_update_between_read_and_write_is_a_conflict(db, monkeypatch, make_order):
+    load_states = order_state._load_states
+
+    async def load_then_modify(db, order_ids):
+        states = await load_states(db, order_ids)
+        # عامل آخر ينقل الطلب الأول بعد قراءة الحالات
+        await db.orders.update_one(
+            {"id": order_ids[0]}, {"$set": {"status": "cancelled"}, "$inc": {"version": 1}}
+        )
+        return states
+
+    monkeypatch.setattr(order_state, "_load_states", load_then_modify)
+
+    async def run():
+        ids = await _insert(db, make_order(), make_order())
+        result = await order_state.transition_orders(db, ids, OrderStatus.PROCESSING)
+        return ids, result
+
+    (changed, untouched), result = asyncio.run(run())
+    assert result.updated == [untouched]
+    [conflict] = result.conflicts
+    assert (conflict.order_id, conflict.reason, conflict.status, conflict.version) == (
+        changed, "concurrent_update", OrderStatus.CANCELLED, 1
+    )
+
+
+def test_archived_delivered_order_can_be_refunded(db, make_order):
+    created_at = datetime(2023, 1, 15)
+
+    async def run():
+        [order_id] = await _insert(db, make_order(OrderStatus.DELIVERED, created_at=created_at), compact=True)
+        moved = await archive.archive_batch(db, cutoff=datetime(2024, 1, 1))
+        result = await order_state.transition_orders(db, [order_id], OrderStatus.REFUNDED, expected_version=0)
+        return order_id, moved, result, await _state(db, order_id, archive.archive_name(created_at))
+
+    order_id, moved, result, state = asyncio.run(run())
+    assert moved == 1
+    assert result.updated == [order_id] and result.conflicts == []
+    assert state == ("refunded", 1)
+
+
+def test_transition_endpoint_maps_conflicts_to_http_errors(db, monkeypatch, make_order):
+    monkeypatch.setattr(database, "db", db)
+
+    async def transition(order_id, status, expected_version=None):
+        return await server.transition_order(
+            order_id, OrderTransition(status=status, expected_version=expected_version), {}
+        )
+
+    async def run():
+        pending, cancelled = await _insert(db, make_order(), make_order(OrderStatus.CANCELLED))
+        errors = []
+        for args in ((str(uuid.uuid4()), OrderStatus.PROCESSING),
+                     (cancelled, OrderStatus.PROCESSING),
+                     (pending, OrderStatus.PROCESSING, 3)):
+            with pytest.raises(HTTPException) as e:
+                await transition(*args)
+            errors.append(e.value.status_code)
+        return errors, await transition(pending, OrderStatus.PROCESSING, 0)
+
+    errors, order = asyncio.run(run())
+    assert errors == [404, 409, 409]
+    assert order.status == OrderStatus.PROCESSING and order.version == 1
+
+
+def test_transition_endpoint_returns_archived_order(db, monkeypatch, make_order):
+    monkeypatch.setattr(database, "db", db)
+
+    async def run():
+        [order_id] = await _insert(db, make_order(OrderStatus.DELIVERED, created_at=datetime(2023, 1, 15)))
+        await archive.archive_batch(db, cutoff=datetime(2024, 1, 1))
+        return await server.transition_order(order_id, OrderTransition(status=OrderStatus.REFUNDED), {})
+
+    order = asyncio.run(run())
+    assert order.status == OrderStatus.REFUNDED and order.version == 1
@@ -0,0 +1,139 @@
+"""
+حدود المعدل
+Token buckets, eviction, concurrency limits, route classes and client keys
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import auth
+import rate_limit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=lambda: now[0], time=lambda: now[0]))
+    return now
+
+
+def _acquire_many(backend, key, count, rate=2, burst=10):
+    async def run():
+        return [await backend.acquire(key, rate, burst) for _ in range(count)]
+    return asyncio.run(run())
+
+
+def test_backend_base_is_abstract():
+    with pytest.raises(TypeError):
+        rate_limit.RateLimitBackend()
+
+
+def test_token_bucket_allows_burst_then_refills(clock):
+    backend = rate_limit.InMemoryBackend(shards=1)
+    results = _acquire_many(backend, "k", 11)
+    assert [allowed for allowed, _ in results] == [True] * 10 + [False]
+    assert results[-1][1] == pytest.approx(0.5)
+
+    clock[0] += 1.0  # معدل 2/ث: رمزان جديدان
+    assert [allowed for allowed, _ in _acquire_many(backend, "k", 3)] == [True, True, False]
+
+
+def test_token_bucket_keys_are_independent(clock):
+    backend = rate_limit.InMemoryBackend(shards=4)
+    _acquire_many(backend, "a", 10)
+    assert _acquire_many(backend, "a", 1)[0][0] is False
+    assert _acquire_many(backend, "b", 1)[0][0] is True
+
+
+def test_eviction_drops_refilled_buckets_first(clock):
+    backend = rate_limit.InMemoryBackend(shards=1, max_keys_per_shard=2)
+    _acquire_many(backend, "old", 1)
+    clock[0] += 10  # امتلأ دلو old مجدداً (burst/rate = 5 ثوان)
+    _acquire_many(backend, "recent", 1)
+    _acquire_many(backend, "new", 1)
+    assert set(backend._shards[0]) == {"recent", "new"}
+
+
+def test_eviction_bounds_shard_size_under_churn(clock):
+    backend = rate_limit.InMemoryBackend(shards=1, max_keys_per_shard=16)
+    for i in range(1000):
+        _acquire_many(backend, f"k{i}", 1)
+    assert len(backend._shards[0]) <= 16
+
+
+def test_concurrency_limiter_queues_then_sheds():
+    async def run():
+        limiter = rate_limit.ConcurrencyLimiter(max_concurrent=1, max_waiting=1, queue_timeout=0.05)
+        assert await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        assert await limiter.acquire() is False  # الطابور ممتلئ: رفض فوري
+        assert await waiter is False            # انتهت المهلة
+        limiter.release()
+        assert await limiter.acquire()
+        assert limiter.waiting == 0
+    asyncio.run(run())
+
+
+def test_concurrency_limiter_hands_over_on_release():
+    async def run():
+        limiter = rate_limit.ConcurrencyLimiter(max_concurrent=1, max_waiting=1, queue_timeout=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        assert await waiter is True
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("POST", "/api/orders", "orders_write"),
+    ("POST", "/api/orders/transitions", "order_transitions"),
+    ("POST", "/api/orders/abc/transition", "order_transitions"),
+    ("POST", "/api/orders/abc/transition/extra", "orders_write"),
+    ("POST", "/api/orders/abc/cancel", "orders_write"),
+    ("GET", "/api/orders", "default"),
+    ("GET", "/api/analytics/dashboard", "analytics"),
+    ("GET", "/api/orders/abc/events", "streams"),
+    ("GET", "/api/notifications/stream", "streams"),
+    ("GET", "/api/cards", "default"),
+])
+def test_classify(method, path, expected):
+    assert rate_limit.classify(method, path).name == expected
+
+
+def _scope(*headers, client=("10.0.0.1", 1234)):
+    return {"headers": [(name.encode(), value.encode()) for name, value in headers], "client": client}
+
+
+def test_client_key_ignores_unknown_api_keys(monkeypatch):
+    monkeypatch.setattr(rate_limit, "API_KEYS", frozenset({"partner-key"}))
+    assert rate_limit.client_key(_scope(("x-api-key", "random"))) == "ip:10.0.0.1"
+    assert rate_limit.client_key(_scope(("x-api-key", "partner-key"))).startswith("key:")
+    assert "partner-key" not in rate_limit.client_key(_scope(("x-api-key", "partner-key")))
+
+
+def test_client_key_rotating_api_keys_share_one_bucket(clock):
+    backend = rate_limit.InMemoryBackend()
+
+    async def run():
+        allowed = 0
+        for i in range(100):
+            key = rate_limit.client_key(_scope(("x-api-key", f"random-{i}")))
+            allowed += (await backend.acquire(f"orders_write:{key}", 2, 10))[0]
+        return allowed
+    assert asyncio.run(run()) == 10
+
+
+def test_client_key_uses_jwt_subject_then_ip(monkeypatch):
+    token = auth.create_access_token("user-1", "customer")
+    assert rate_limit.client_key(_scope(("authorization", f"Bearer {token}"))) == "user:user-1"
+    assert rate_limit.client_key(_scope(("authorization", "Bearer invalid"))) == "ip:10.0.0.1"
+
+    forwarded = _scope(("x-forwarded-for", "203.0.113.7, 10.0.0.2"))
+    assert rate_limit.client_key(forwarded) == "ip:10.0.0.1"
+    monkeypatch.setattr(rate_limit, "TRUST_FORWARDED_FOR", True)
+    assert rate_limit.client_key(forwarded) == "ip:203.0.113.7"
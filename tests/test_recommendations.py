@@ -0,0 +1,136 @@
+"""
+توصيات البطاقات
+Co-purchase counts, idempotent batches after a crash and lease ownership
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import archive
+import recommendations
+from models import OrderStatus
+
+
+CARDS = ["a", "b", "c", "d"]
+BASKETS = [["a", "b"], ["a", "c"], ["b", "c", "d"], ["a", "b", "c"], ["d"], ["a", "d"], ["b", "c"]]
+
+
+@pytest.fixture
+def orders(make_order):
+    """طلبات مكتملة بسلال BASKETS بفارق دقيقة بين كل طلب"""
+    start = datetime.utcnow() - timedelta(days=1)
+    return [
+        make_order(
+            OrderStatus.COMPLETED,
+            items=[{"card_product_id": card, "quantity": 2, "unit_price": 1.0} for card in basket],
+            created_at=start + timedelta(minutes=i),
+        )
+        for i, basket in enumerate(BASKETS)
+    ]
+
+
+async def _counts(db) -> dict:
+    return {doc["card_id"]: (doc.get("sold"), doc.get("co"))
+            async for doc in db[recommendations.COLLECTION].find({"kind": "card"})}
+
+
+def test_co_purchase_counts_skips_orders_already_applied_per_card():
+    at = [datetime(2024, 1, day) for day in (1, 1, 2, 2)]
+    rows = {"order": [0, 0, 1, 1], "card": ["a", "b", "a", "b"], "quantity": [1, 2, 3, 4], "created_at": at}
+
+    counts, sold = recommendations.co_purchase_counts(rows)
+    assert sold.to_dict() == {"a": 4, "b": 6}
+    assert counts.to_dict() == {("a", "b"): 2, ("b", "a"): 2}
+
+    counts, sold = recommendations.co_purchase_counts(rows, {"a": datetime(2024, 1, 1)})
+    assert sold.to_dict() == {"a": 3, "b": 6}
+    assert counts.to_dict() == {("a", "b"): 1, ("b", "a"): 2}
+
+
+@pytest.mark.parametrize("retry_batch_size", [2, 3, 100])
+def test_rerun_after_crash_before_watermark_does_not_double_count(db, monkeypatch, orders, retry_batch_size):
+    renew_lease = recommendations._renew_lease
+
+    async def crash_on_second_batch(db, owner, **fields):
+        crash_on_second_batch.calls += 1
+        if crash_on_second_batch.calls == 2:
+            raise RuntimeError("توقف بعد كتابة العدادات وقبل حفظ نقطة التقدم")
+        await renew_lease(db, owner, **fields)
+    crash_on_second_batch.calls = 0
+
+    async def run():
+        await db.orders.insert_many(orders)
+        await recommendations.build(db, batch_size=100)
+        expected = await _counts(db)
+        await recommendations.reset(db)
+
+        monkeypatch.setattr(recommendations, "_renew_lease", crash_on_second_batch)
+        with pytest.raises(RuntimeError):
+            await recommendations.build(db, batch_size=2)
+        monkeypatch.setattr(recommendations, "_renew_lease", renew_lease)
+
+        await recommendations.build(db, batch_size=retry_batch_size)
+        return expected, await _counts(db)
+
+    expected, counts = asyncio.run(run())
+    assert counts == expected
+
+
+def test_lost_lease_stops_build_without_advancing_watermark(db, monkeypatch, orders):
+    renew_lease = recommendations._renew_lease
+
+    async def taken_over(db, owner, **fields):
+        # انتهت مدة القفل وأخذه عامل آخر أثناء الدفعة
+        await db[recommendations.COLLECTION].update_one(
+            {"_id": recommendations.STATE_ID}, {"$set": {"owner": "other"}}
+        )
+        await renew_lease(db, owner, **fields)
+
+    monkeypatch.setattr(recommendations, "_renew_lease", taken_over)
+
+    async def run():
+        await db.orders.insert_many(orders)
+        processed = await recommendations.build(db, batch_size=2)
+        return processed, await db[recommendations.COLLECTION].find_one({"_id": recommendations.STATE_ID})
+
+    processed, state = asyncio.run(run())
+    assert processed == 0
+    assert state.get("last_created_at") is None
+    assert state["owner"] == "other" and state["lease_until"] is not None
+
+
+def test_build_releases_lease_and_is_incremental(db, orders):
+    async def run():
+        await db.orders.insert_many(orders)
+        first = await recommendations.build(db, batch_size=2)
+        state = await db[recommendations.COLLECTION].find_one({"_id": recommendations.STATE_ID})
+        return first, state, await recommendations.build(db, batch_size=2)
+
+    first, state, second = asyncio.run(run())
+    assert (first, second) == (len(BASKETS), 0)
+    assert "owner" not in state and "lease_until" not in state
+
+
+@pytest.mark.parametrize("batch_size", [1, 100])
+def test_hot_orders_older_than_archived_orders_are_counted(db, make_order, batch_size):
+    # الطلبات المكتملة لا تُؤرشف فتبقى في المجموعة الساخنة بتاريخ أقدم من طلبات مؤرشفة
+    def order(status, created_at, cards):
+        items = [{"card_product_id": card, "quantity": 1, "unit_price": 1.0} for card in cards]
+        return make_order(status, items=items, created_at=created_at)
+
+    async def run():
+        await db.orders.insert_many([
+            order(OrderStatus.COMPLETED, datetime(2023, 1, 10), ["a", "b"]),
+            order(OrderStatus.DELIVERED, datetime(2023, 3, 10), ["a", "c"]),
+        ])
+        await archive.archive_batch(db, datetime(2024, 1, 1))
+        processed = await recommendations.build(db, batch_size=batch_size)
+        state = await db[recommendations.COLLECTION].find_one({"_id": recommendations.STATE_ID})
+        return processed, await _counts(db), state["last_created_at"]
+
+    processed, counts, watermark = asyncio.run(run())
+    assert processed == 2
+    assert counts == {"a": (2, {"b": 1, "c": 1}), "b": (1, {"a": 1}), "c": (1, {"a": 1})}
+    assert watermark == datetime(2023, 3, 10)
@@ -0,0 +1,50 @@
+"""
+زمن بدء تشغيل الخادم
+Import-time budget for backend/server.py, measured with python -X importtime
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+# الميزانية بالميلي ثانية لزمن import server التراكمي (المقيس ~600-780ms مع هامش للتفاوت)
+IMPORT_BUDGET_MS = float(os.environ.get('STARTUP_IMPORT_BUDGET_MS', '1000'))
+
+# وحدات يجب ألا تُحمّل عند بدء العامل
+DEFERRED_MODULES = {"pandas", "numpy", "boto3", "motor", "passlib"}
+
+
+def _import_times(module: str):
+    """زمن الاستيراد التراكمي (ميكروثانية) لكل وحدة من مخرجات -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            continue  # سطر العناوين
+    return times
+
+
+def test_server_import_within_budget():
+    times = _import_times("server")
+    elapsed_ms = times["server"] / 1000
+    assert elapsed_ms < IMPORT_BUDGET_MS, f"import server: {elapsed_ms:.0f}ms > {IMPORT_BUDGET_MS:.0f}ms"
+
+
+def test_server_import_skips_heavy_modules():
+    loaded = {name.split(".")[0] for name in _import_times("server")}
+    assert not loaded & DEFERRED_MODULES, f"heavy modules imported at startup: {sorted(loaded & DEFERRED_MODULES)}"